@@ -0,0 +1,94 @@
+"""
+Micro-batching
+This module coalesces concurrent inference requests into a single batched model call.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+
+class MicroBatcher:
+    """
+    Collect concurrent calls to `submit` for up to `max_wait_ms` (or until
+    `max_batch_size` items are waiting), run `batch_fn` once over the whole
+    batch and hand each caller back its own result.
+
+    `batch_fn` is a blocking function that takes a list of items and returns a
+    list of results in the same order. It runs in a worker thread so the event
+    loop stays free while the model is busy; pass `run` (an async callable
+    taking `batch_fn` and the items) to choose where it runs.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Sequence[Any]], max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 run: Optional[Callable[[Callable, List[Any]], Awaitable[Sequence[Any]]]] = None):
+        self.batch_fn = batch_fn
+        self.run = run
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue a single item and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Take the waiting items off the queue and start one batched run"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        try:
+            if self.run is not None:
+                results = await self.run(self.batch_fn, items)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.batch_fn, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # The caller may have gone away (e.g. client disconnected)
+            if not future.done():
+                future.set_result(result)
+
+
+def run_batch_isolated(batch_fn: Callable[[List[Any]], Sequence[Any]], items: List[Any]) -> List[Tuple[Any, Optional[str]]]:
+    """
+    Run `batch_fn` over `items`, isolating failures to the items that caused them.
+
+    The whole list is tried first; if that raises, each item is retried on its
+    own so one bad input does not fail the rest of the batch.
+
+    Returns:
+        List of (result, error) pairs; `error` is None on success
+    """
+    try:
+        return [(result, None) for result in batch_fn(items)]
+    except Exception:
+        pass
+
+    outcomes = []
+    for item in items:
+        try:
+            outcomes.append((batch_fn([item])[0], None))
+        except Exception as e:
+            outcomes.append((None, str(e)))
+    return outcomes
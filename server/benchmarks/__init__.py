@@ -0,0 +1,4 @@
+"""
+Benchmarks
+Load tests for the API routes. See benchmarks/run.py for usage.
+"""
@@ -0,0 +1,87 @@
+"""
+Benchmark Clients
+Minimal clients that POST JSON either straight into the ASGI app (no server) or to a running server over HTTP.
+Neither needs anything beyond the standard library.
+"""
+import asyncio
+import json
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+
+class ASGIClient:
+    """Calls the ASGI application in the current process"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def post(self, path: str, payload: dict) -> Tuple[int, bytes]:
+        body = json.dumps(payload).encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("ascii"),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        sent = False
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Block like a connected client until the app is done
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    async def close(self):
+        pass
+
+
+class HTTPClient:
+    """Posts to a running server; each request uses a thread from a pool sized to the concurrency"""
+
+    def __init__(self, base_url: str, concurrency: int = 16, timeout: float = 300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="bench-http")
+
+    def _post(self, path: str, payload: dict) -> Tuple[int, bytes]:
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def post(self, path: str, payload: dict) -> Tuple[int, bytes]:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._post, path, payload)
+
+    async def close(self):
+        self._pool.shutdown(wait=False)
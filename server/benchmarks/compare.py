@@ -0,0 +1,70 @@
+"""
+Benchmark Comparison
+Compares two benchmark result files route by route.
+
+Usage (from the server directory):
+    python -m benchmarks.compare before.json after.json --max-regression 0.1
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+
+def _relative_change(before: float, after: float) -> float:
+    return (after - before) / before if before else 0.0
+
+
+def compare(baseline: Dict, current: Dict, max_regression: float = 0.1) -> List[Dict]:
+    """
+    Match results by route and concurrency and flag regressions: p50 or p99
+    latency up, or throughput down, by more than `max_regression`.
+    """
+    before = {(r["route"], r["concurrency"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = before.get((result["route"], result["concurrency"]))
+        if old is None:
+            continue
+        changes = {
+            "p50": _relative_change(old["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+            "p99": _relative_change(old["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+            "throughput": _relative_change(old["throughput_rps"], result["throughput_rps"]),
+        }
+        rows.append({
+            "route": result["route"],
+            "concurrency": result["concurrency"],
+            "changes": changes,
+            "regressed": (changes["p50"] > max_regression or changes["p99"] > max_regression
+                          or changes["throughput"] < -max_regression),
+        })
+    return rows
+
+
+def print_comparison(rows: List[Dict]):
+    for row in rows:
+        changes = row["changes"]
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        print(f"{row['route']:<18} c={row['concurrency']:<4} p50 {changes['p50']:+7.1%}  p99 {changes['p99']:+7.1%}  "
+              f"throughput {changes['throughput']:+7.1%}  {flag}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.max_regression)
+    print_comparison(rows)
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
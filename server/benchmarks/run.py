@@ -0,0 +1,250 @@
+"""
+API Benchmark
+Drives the four main API routes at several concurrency levels and reports throughput,
+latency percentiles and peak RSS, saved as JSON for regression comparison.
+
+Usage (from the server directory):
+    python -m benchmarks.run                                   # stub models, in-process
+    python -m benchmarks.run --target uvicorn --concurrency 1 8 32
+    python -m benchmarks.run --url http://localhost:5000 --models configured
+    python -m benchmarks.run --output after.json --baseline before.json
+
+By default the result cache is disabled so every request reaches a model.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.client import ASGIClient, HTTPClient
+from benchmarks.compare import compare, print_comparison
+
+# Route -> function building the JSON body of the i-th request
+ROUTES = {
+    "create-metaphors": ("/api/create-metaphors", lambda i: {
+        "source": ["love", "time", "hope", "memory"][i % 4],
+        "target": ["ocean", "river", "star", "garden"][i % 4],
+        "emotion": ["positive", "negative", "neutral"][i % 3],
+    }),
+    "predict": ("/api/predict", lambda i: {
+        "text": f"Her smile is the sunrise of my morning {i}",
+    }),
+    "generate-lyrics": ("/api/generate-lyrics", lambda i: {
+        "motion": ["happy", "sad", "love"][i % 3],
+        "seed": "" if i % 2 else f"மழை {i}",
+        "count": 1,
+    }),
+    "predict-mask": ("/api/predict-mask", lambda i: {
+        "text": f"I want to [mask] to the beach {i}" if i % 2 else f"நான் பள்ளிக்கு [mask] {i}",
+        "top_k": 5,
+    }),
+}
+
+
+def read_peak_rss(pid: int) -> Optional[int]:
+    """Peak resident set size (VmHWM) of a process in bytes, if /proc is available"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid: int):
+    """Reset VmHWM so the next reading covers only the following run (Linux only, best effort)"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def summarize(route: str, concurrency: int, latencies: List[float], statuses: List[int], elapsed: float) -> Dict:
+    ok = [latency for latency, status in zip(latencies, statuses) if status == 200]
+    ms = np.array(ok) * 1000 if ok else np.zeros(1)
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(statuses),
+        "ok": len(ok),
+        "errors": {str(status): statuses.count(status) for status in sorted(set(statuses)) if status != 200},
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(float(ms.mean()), 3),
+            "p50": round(float(np.percentile(ms, 50)), 3),
+            "p90": round(float(np.percentile(ms, 90)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3),
+            "max": round(float(ms.max()), 3),
+        },
+    }
+
+
+async def run_level(client, route: str, concurrency: int, requests: int) -> Dict:
+    """Send `requests` requests to one route with `concurrency` of them in flight at a time"""
+    path, payload = ROUTES[route]
+    latencies = [0.0] * requests
+    statuses = [0] * requests
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                statuses[index], _ = await client.post(path, payload(index))
+            except Exception as e:
+                print(f"Request to {path} failed: {str(e)}")
+                statuses[index] = -1
+            latencies[index] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(route, concurrency, latencies, statuses, time.perf_counter() - start)
+
+
+async def run_benchmark(client, pid: Optional[int], routes: List[str], levels: List[int],
+                        requests: int, warmup: int) -> List[Dict]:
+    results = []
+    for route in routes:
+        # Warm-up requests load the model and are not measured
+        path, payload = ROUTES[route]
+        for i in range(warmup):
+            await client.post(path, payload(i))
+
+        for concurrency in levels:
+            if pid is not None:
+                reset_peak_rss(pid)
+            result = await run_level(client, route, concurrency, requests)
+            result["peak_rss_bytes"] = read_peak_rss(pid) if pid is not None else None
+            results.append(result)
+            print(f"{route:<18} c={concurrency:<4} {result['throughput_rps']:>9.2f} req/s  "
+                  f"p50 {result['latency_ms']['p50']:>9.1f} ms  p99 {result['latency_ms']['p99']:>9.1f} ms  "
+                  f"errors {sum(result['errors'].values())}")
+    return results
+
+
+def benchmark_env(args) -> Dict[str, str]:
+    env = {"PRELOAD_MODELS": "0"}
+    if not args.with_cache:
+        env.update({"RESULT_CACHE_SIZE": "0", "RESULT_CACHE_DB": ""})
+    if args.models == "stub":
+        from benchmarks.stub_models import stub_model_env
+        env.update(stub_model_env(args.stub_dir or tempfile.mkdtemp(prefix="stub-models-")))
+    return env
+
+
+async def run_in_process(args, env: Dict[str, str]) -> List[Dict]:
+    os.environ.update(env)
+    # Imported only now: the registry reads the model environment variables at import
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        return await run_benchmark(ASGIClient(main.app), os.getpid(), args.routes, args.concurrency,
+                                   args.requests, args.warmup)
+
+
+def wait_until_healthy(url: str, process: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/healthz", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"Server did not become healthy within {timeout} seconds")
+
+
+async def run_against_server(args, env: Dict[str, str]) -> List[Dict]:
+    process = None
+    pid = None
+    url = args.url
+    if url is None:
+        # Start a local uvicorn with the benchmark environment
+        url = f"http://127.0.0.1:{args.port}"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"],
+            env={**os.environ, **env},
+        )
+        pid = process.pid
+        wait_until_healthy(url, process)
+
+    client = HTTPClient(url, concurrency=max(args.concurrency))
+    try:
+        return await run_benchmark(client, pid, args.routes, args.concurrency, args.requests, args.warmup)
+    finally:
+        await client.close()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the API routes")
+    parser.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess",
+                        help="Call the app in this process or start a local uvicorn server")
+    parser.add_argument("--url", help="Benchmark an already running server instead (models and cache are as configured there)")
+    parser.add_argument("--port", type=int, default=5055, help="Port for --target uvicorn")
+    parser.add_argument("--models", choices=["stub", "configured"], default="stub",
+                        help="Tiny random stub models (offline) or the models configured in the environment")
+    parser.add_argument("--stub-dir", help="Where to write stub models (default: a temporary directory)")
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Measured requests per route and concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per route before measuring")
+    parser.add_argument("--with-cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="Allowed relative p50/p99 increase or throughput drop against the baseline")
+    args = parser.parse_args(argv)
+
+    env = {} if args.url else benchmark_env(args)
+    if args.target == "inprocess" and args.url is None:
+        results = asyncio.run(run_in_process(args, env))
+    else:
+        results = asyncio.run(run_against_server(args, env))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "target": args.url or args.target,
+            "models": "configured" if args.url else args.models,
+            "result_cache": args.with_cache or bool(args.url),
+            "requests": args.requests,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, args.max_regression)
+        print_comparison(rows)
+        return 1 if any(row["regressed"] for row in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Stub Models
+Tiny randomly initialised models with the same architectures as the real ones, so benchmarks run offline.
+Their outputs are meaningless; only the cost of running them matters.
+"""
+import os
+from typing import Dict, List
+
+import torch
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+from transformers import (BertConfig, BertForMaskedLM, BertForSequenceClassification, BertTokenizerFast,
+                          GPT2Config, GPT2LMHeadModel, GPT2TokenizerFast)
+
+# Small enough to build in seconds, large enough that the forward pass is not negligible
+HIDDEN_SIZE = 128
+LAYERS = 2
+HEADS = 4
+VOCAB_SIZE = 2000
+
+
+def _corpus() -> List[str]:
+    """Text the stub tokenizers are trained on, so prompts split into a realistic number of tokens"""
+    words = ["love", "time", "hope", "memory", "ocean", "river", "star", "garden", "flower", "night", "journey",
+             "happy", "sad", "beach", "book", "dinner", "want", "read", "walk", "smile", "sunrise", "morning"]
+    # Nothing from models/ is imported here: the registry must not be built before the stub environment is set
+    templates = ["{a} is like a {b}, radiating beauty in the simplest of moments.",
+                 "Just as a {b} captures light, {a} captures the essence of beauty and wonder.",
+                 "{a} is like a cold {b}, distant and unyielding despite its beauty."]
+    prefixes = ["Create a beautiful metaphor comparing", "Create a deep metaphor comparing",
+                "Create a nature metaphor comparing", "Create a profound metaphor comparing"]
+    lines = [t.format(a=a, b=b) for t in templates for a, b in zip(words, reversed(words))]
+    lines += [f"{prefix} {a} to {b}. {a} is like" for prefix in prefixes for a, b in zip(words, words[3:])]
+    lines += [f"<emotion:{emotion}> <sep>" for emotion in ("happy", "sad", "love", "angry", "calm")]
+    lines += ["நான் பள்ளிக்கு செல்கிறேன்", "மழை பெய்கிறது", "நீ என் வாழ்வின் ஒளி", "அவள் கண்கள் கடல் போல ஆழமானவை",
+              "அவன் புத்தகம் படிக்கிறான்", "அவர் உணவு சாப்பிட்டார்", "Her smile is the sunrise of my morning",
+              "I want to go to the beach", "She read a book yesterday", "We eat dinner together every night"]
+    return lines * 4
+
+
+def _bert_tokenizer() -> BertTokenizerFast:
+    tokenizer = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=False)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tokenizer.decoder = decoders.WordPiece()
+    special = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    tokenizer.train_from_iterator(_corpus(), trainers.WordPieceTrainer(vocab_size=VOCAB_SIZE, special_tokens=special))
+    tokenizer.post_processor = processors.BertProcessing(("[SEP]", tokenizer.token_to_id("[SEP]")),
+                                                         ("[CLS]", tokenizer.token_to_id("[CLS]")))
+    return BertTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]",
+                             cls_token="[CLS]", mask_token="[MASK]")
+
+
+def _gpt2_tokenizer() -> GPT2TokenizerFast:
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=VOCAB_SIZE, special_tokens=["<|endoftext|>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(_corpus(), trainer)
+    return GPT2TokenizerFast(tokenizer_object=tokenizer, bos_token="<|endoftext|>", eos_token="<|endoftext|>",
+                             unk_token="<|endoftext|>")
+
+
+def _bert_config(tokenizer) -> BertConfig:
+    return BertConfig(vocab_size=len(tokenizer), hidden_size=HIDDEN_SIZE, num_hidden_layers=LAYERS,
+                      num_attention_heads=HEADS, intermediate_size=HIDDEN_SIZE * 4, max_position_embeddings=512)
+
+
+def _save(directory: str, tokenizer, model):
+    os.makedirs(directory, exist_ok=True)
+    tokenizer.save_pretrained(directory)
+    model.save_pretrained(directory)
+
+
+def build_stub_models(directory: str) -> Dict[str, str]:
+    """
+    Write a stub model for every registry entry under `directory`.
+
+    Returns:
+        Dict mapping registry name to the model directory
+    """
+    torch.manual_seed(0)
+    paths = {name: os.path.join(directory, name) for name in
+             ("metaphor_creator", "metaphor_classifier", "lyric_generator", "masking_predict")}
+
+    tokenizer = _bert_tokenizer()
+    _save(paths["metaphor_classifier"], tokenizer, BertForSequenceClassification(_bert_config(tokenizer)))
+    _save(paths["masking_predict"], tokenizer, BertForMaskedLM(_bert_config(tokenizer)))
+
+    tokenizer = _gpt2_tokenizer()
+    for name in ("metaphor_creator", "lyric_generator"):
+        config = GPT2Config(vocab_size=len(tokenizer), n_layer=LAYERS, n_embd=HIDDEN_SIZE, n_head=HEADS, n_positions=256)
+        _save(paths[name], tokenizer, GPT2LMHeadModel(config))
+
+    return paths
+
+
+def stub_model_env(directory: str) -> Dict[str, str]:
+    """
+    Environment variables that point the model registry at the stub models.
+    They must be set before `main` (and so models/registry.py) is imported.
+    """
+    env = {"DEVICE": "cpu"}
+    for name, path in build_stub_models(directory).items():
+        env[f"{name.upper()}_MODEL"] = path
+        env[f"{name.upper()}_FALLBACK_MODEL"] = ""
+    return env
@@ -0,0 +1,212 @@
+"""
+Result Cache
+This module caches results of deterministic endpoints, keyed on a hash of the model name, normalized text and options.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC, trimmed, single spaces"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(model_name: str, text: str, top_k: Optional[int] = None, normalize: bool = True, **options) -> str:
+    """
+    Hash of everything that determines a result; extra options are included in sorted order.
+    Pass `normalize=False` when the result refers to positions in the exact text (e.g. character offsets).
+    """
+    payload = json.dumps([model_name, normalize_text(text) if normalize else text, top_k, sorted(options.items())],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-process cache with a size limit and per-entry time-to-live"""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    On-disk cache shared by every worker process on the host.
+    Values are stored as JSON, so only JSON-serialisable results can be cached.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl_seconds),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+
+class ResultCache:
+    """
+    Two-tier cache: the in-process LRU is checked first, then the optional
+    shared on-disk tier. Disk hits are copied into memory.
+    """
+
+    def __init__(self, memory: Optional[LRUCache] = None, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or self.disk is not None
+
+    def _memory_get(self, key: str) -> Optional[Any]:
+        if self.memory is None:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+        return value
+
+    def _disk_get(self, key: str) -> Optional[Any]:
+        try:
+            return self.disk.get(key)
+        except sqlite3.Error as e:
+            print(f"Result cache read failed: {str(e)}")
+            return None
+
+    def _disk_set(self, key: str, value: Any):
+        try:
+            self.disk.set(key, value)
+        except sqlite3.Error as e:
+            print(f"Result cache write failed: {str(e)}")
+
+    def _record_disk_result(self, key: str, value: Optional[Any]) -> Optional[Any]:
+        if value is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        if self.memory is not None:
+            self.memory.set(key, value)
+        return value
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        return self._record_disk_result(key, self._disk_get(key) if self.disk is not None else None)
+
+    def set(self, key: str, value: Any):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            self._disk_set(key, value)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """Like get(), but SQLite lookups run in a worker thread instead of blocking the event loop"""
+        return (await self.aget_many([key]))[0]
+
+    async def aget_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Look up several keys; every memory miss is read from SQLite in a single worker-thread call"""
+        values = [self._memory_get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        disk_values = [None] * len(missing)
+        if missing and self.disk is not None:
+            disk_values = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [self._disk_get(keys[i]) for i in missing])
+        for i, value in zip(missing, disk_values):
+            values[i] = self._record_disk_result(keys[i], value)
+        return values
+
+    async def aset(self, key: str, value: Any):
+        """Like set(), but the SQLite write and commit run in a worker thread"""
+        await self.aset_many([(key, value)])
+
+    async def aset_many(self, items: List[Tuple[str, Any]]):
+        """Store several results; the SQLite writes run in a single worker-thread call"""
+        if self.memory is not None:
+            for key, value in items:
+                self.memory.set(key, value)
+        if items and self.disk is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [self._disk_set(key, value) for key, value in items])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self.memory) if self.memory is not None else 0,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Build the cache from RESULT_CACHE_SIZE (0 disables the memory tier),
+        RESULT_CACHE_TTL (seconds) and RESULT_CACHE_DB (path of the shared
+        SQLite tier; unset disables it).
+        """
+        size = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+        ttl = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+        db_path = os.getenv("RESULT_CACHE_DB")
+
+        memory = LRUCache(size, ttl) if size > 0 else None
+        disk = SQLiteCache(db_path, ttl) if db_path else None
+        return cls(memory, disk)
@@ -0,0 +1,20 @@
+"""
+Production server configuration.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Models are loaded once in the master process before the workers are forked,
+so every worker shares the same weights copy-on-write instead of loading its
+own copy.
+"""
+import os
+
+# main.py preloads the model registry at import time when this is set
+os.environ.setdefault("PRELOAD_BEFORE_FORK", "1")
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Model loading can take a while on a cold cache
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
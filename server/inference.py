@@ -0,0 +1,122 @@
+"""
+Inference Executor
+This module runs blocking model code on per-model worker pools so the asyncio event loop stays responsive.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+# Models served by the API, used to size the default pools
+MODEL_NAMES = ["metaphor_creator", "metaphor_classifier", "lyric_generator", "masking_predict"]
+
+
+class QueueFullError(Exception):
+    """Raised when a model's queue is full and the request should be retried later"""
+
+    def __init__(self, model_name: str, retry_after: int):
+        super().__init__(f"Too many pending requests for {model_name}")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+class ModelPool:
+    """A fixed number of worker threads for one model plus a bounded wait queue"""
+
+    def __init__(self, name: str, workers: int = 1, max_queue: int = 16):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"inference-{name}")
+        # Requests running or waiting for a worker; only touched from the event loop
+        self.pending = 0
+        # Moving average of job duration, used to estimate Retry-After
+        self.avg_seconds = 1.0
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a slot frees up"""
+        return max(1, math.ceil(self.avg_seconds * self.pending / self.workers))
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """Queue a call and return a future for it; raises QueueFullError right away when full"""
+        if self.pending >= self.workers + self.max_queue:
+            raise QueueFullError(self.name, self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        # Carry context variables into the worker thread like asyncio.to_thread does
+        context = contextvars.copy_context()
+        call = partial(context.run, self._timed, fn, *args, **kwargs)
+
+        self.pending += 1
+        future = loop.run_in_executor(self.executor, call)
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await self.submit(fn, *args, **kwargs)
+
+    def start(self):
+        """Threads are started on demand"""
+
+    def _release(self, future: asyncio.Future):
+        self.pending -= 1
+
+    def _timed(self, fn: Callable, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.perf_counter() - start)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InferenceExecutor:
+    """
+    Routes blocking inference calls to the worker pool of the model they use.
+
+    Pool sizes come from `<MODEL>_WORKERS` and `<MODEL>_QUEUE_SIZE` environment
+    variables, e.g. `LYRIC_GENERATOR_WORKERS=2`.
+
+    With `SERVING_MODE=processes` the workers are separate processes (see
+    workers.py) that load the models themselves, started by `start()`.
+    """
+
+    def __init__(self):
+        self.processes = os.getenv("SERVING_MODE", "threads") == "processes"
+        self.pools: Dict[str, ModelPool] = {}
+        if self.processes:
+            from workers import process_pools
+            self.pools.update(process_pools(MODEL_NAMES))
+            return
+        for name in MODEL_NAMES:
+            prefix = name.upper()
+            self.pools[name] = ModelPool(
+                name,
+                workers=int(os.getenv(f"{prefix}_WORKERS", "1")),
+                max_queue=int(os.getenv(f"{prefix}_QUEUE_SIZE", "16")),
+            )
+
+    async def run(self, model_name: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` on the pool for `model_name` and await the result"""
+        return await self.pools[model_name].run(fn, *args, **kwargs)
+
+    def submit(self, model_name: str, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """Like `run`, but returns the future without waiting for it"""
+        return self.pools[model_name].submit(fn, *args, **kwargs)
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {name: pool.pending for name, pool in self.pools.items()}
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown()
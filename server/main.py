@@ -1,16 +1,56 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import gc
+import os
 import uvicorn
 
 # Import model modules
-from models.metaphor_creator import generate_metaphor
-from models.metaphor_classifier import classify_metaphor
-from models.lyric_generator import generate_lyrics_text
-from models.masking_predict import predict_masked_tokens
+from models.metaphor_creator import generate_metaphor, stream_metaphors
+from models.metaphor_classifier import classify_metaphor_batch, classify_metaphor_windows, count_tokens, truncate_to_tokens
+from models.lyric_generator import generate_lyrics_batch, stream_lyrics_text
+from models.masking_predict import predict_all_masks, predict_masked_tokens_batch
+from models.postprocess import dedupe_near_duplicates
+from models.generation_utils import Deadline
+from models.registry import registry
+from batching import MicroBatcher, run_batch_isolated
+from inference import InferenceExecutor, QueueFullError
+from streaming import TokenChannel, stream_events
+from cache import ResultCache, make_key
+import metrics
+import warmup
 
-app = FastAPI(title="Song Analysis API")
+if os.getenv("PRELOAD_BEFORE_FORK") == "1":
+    # Load weights in the master process (e.g. gunicorn --preload) so forked
+    # workers share them copy-on-write. No inference runs here: warm-up
+    # happens in each worker after the fork.
+    registry.preload()
+    # Keep the cyclic GC from touching (and so copying) the preloaded objects
+    gc.freeze()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load every model in the background; /readyz reports when they are done.
+    # Without preloading the models load on first use, so the server is ready at once.
+    warmup_task = None
+    # In process mode every model worker loads and warms its model on start-up
+    inference.start()
+    if os.getenv("PRELOAD_MODELS", "1") == "1" and not inference.processes:
+        loop = asyncio.get_running_loop()
+        warmup_task = loop.run_in_executor(None, warmup.warm_up_all)
+    elif not inference.processes:
+        warmup.mark_on_demand()
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    inference.shutdown()
+
+app = FastAPI(title="Song Analysis API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -21,113 +61,464 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency per route; SERVER_TIMING=1 adds a Server-Timing header with per-stage inference timings
+app.add_middleware(metrics.MetricsMiddleware, server_timing=os.getenv("SERVER_TIMING") == "1")
+
+# Blocking model code runs on per-model worker pools, off the event loop
+inference = InferenceExecutor()
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {str(exc)}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Concurrent /api/predict calls are coalesced into one forward pass
+predict_batcher = MicroBatcher(
+    classify_metaphor_batch,
+    max_batch_size=int(os.getenv("PREDICT_BATCH_MAX_SIZE", "16")),
+    max_wait_ms=float(os.getenv("PREDICT_BATCH_WAIT_MS", "10")),
+    run=lambda fn, items: inference.run("metaphor_classifier", fn, items),
+)
+
+# Results of the deterministic endpoints (/api/predict, /api/predict-mask) are cached
+result_cache = ResultCache.from_env()
+
+def result_key(model_name: str, text: str, top_k: Optional[int] = None, normalize: bool = True, **options) -> Optional[str]:
+    """
+    Cache key for a result of registry model `model_name`, covering the model that actually
+    serves it (id, backend, precision, revision). None while no model is loaded, so results
+    computed before the load finishes are not cached.
+    """
+    if inference.processes:
+        # The model lives in the worker processes, which report what they loaded
+        model = warmup.model_states[model_name].model
+    else:
+        model = registry.identity(model_name)
+    if model is None:
+        return None
+    return make_key(model["model_id"], text, top_k, normalize, backend=model["backend"],
+                    precision=model["precision"], revision=model["revision"], **options)
+
+async def run_cached_batch(model_name: str, texts: List[str], batch_fn, cacheable=lambda result: True, **key_options):
+    """
+    Answer each text from the cache where possible and run only the misses through batch_fn.
+    Results for which `cacheable` returns False (e.g. predefined fallbacks) are not stored.
+    """
+    keys = [result_key(model_name, text, **key_options) for text in texts]
+    cached = await result_cache.aget_many(keys) if None not in keys else [None] * len(texts)
+    outcomes = [None] * len(texts)
+    missing = []
+    for i, result in enumerate(cached):
+        if result is not None:
+            outcomes[i] = (result, None)
+        else:
+            missing.append(i)
+
+    if missing:
+        computed = await inference.run(model_name, run_batch_isolated, batch_fn, [texts[i] for i in missing])
+        for i, outcome in zip(missing, computed):
+            outcomes[i] = outcome
+        # Keyed again: the batch may have loaded the model, or been answered by a fallback
+        stored = [(result_key(model_name, texts[i], **key_options), result)
+                  for i, (result, error) in zip(missing, computed) if error is None and cacheable(result)]
+        await result_cache.aset_many([(key, result) for key, result in stored if key is not None])
+    return outcomes
+
+# Limits for the /batch endpoints
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "32"))
+
+# Token budget per /api/predict request: longer texts are rejected (413) or
+# downgraded to a single pass over their first PREDICT_TOKEN_BUDGET tokens
+PREDICT_TOKEN_BUDGET = int(os.getenv("PREDICT_TOKEN_BUDGET", "2048"))
+PREDICT_BUDGET_POLICY = os.getenv("PREDICT_BUDGET_POLICY", "downgrade")
+# Window size (tokens) for mode="window"; must stay below the model's 512-token limit
+PREDICT_WINDOW_TOKENS = int(os.getenv("PREDICT_WINDOW_TOKENS", "128"))
+
+# Upper bound for the `count` of /api/generate-lyrics
+LYRICS_MAX_COUNT = int(os.getenv("LYRICS_MAX_COUNT", "10"))
+
+# Longest a generation request may take (ms, queueing included) before partial
+# results are returned; requests can ask for less with `deadline_ms`. 0 disables it.
+GENERATION_DEADLINE_MS = int(os.getenv("GENERATION_DEADLINE_MS", "0"))
+# Stop generating a metaphor at the end of its first sentence
+METAPHOR_STOP_AT_SENTENCE_END = os.getenv("METAPHOR_STOP_AT_SENTENCE_END", "1") == "1"
+# Default number of lines after which lyric generation stops (0 for no limit)
+LYRICS_MAX_LINES = int(os.getenv("LYRICS_MAX_LINES", "0"))
+
+def request_deadline(deadline_ms: Optional[int]) -> Optional[Deadline]:
+    """Deadline for a generation request: the tighter of the requested and the server-wide one"""
+    limits = [ms for ms in (deadline_ms, GENERATION_DEADLINE_MS) if ms and ms > 0]
+    return Deadline.from_ms(min(limits)) if limits else None
+
+def deadline_hit(deadline: Optional[Deadline]) -> bool:
+    return deadline is not None and deadline.hit
+
 # Models for request/response data
 class MetaphorRequest(BaseModel):
     source: str
     target: str
     emotion: Optional[str] = "positive"
+    deadline_ms: Optional[int] = None
 
 class MetaphorResponse(BaseModel):
     metaphors: List[str]
+    # True when the deadline cut generation short
+    partial: bool = False
     
 class PredictionRequest(BaseModel):
     text: str
+    # "truncate": one pass over the first 512 tokens; "window": overlapping sentence windows over the whole text
+    mode: Optional[Literal["truncate", "window"]] = "truncate"
+
+class MetaphorSpan(BaseModel):
+    start: int
+    end: int
+    text: str
+    is_metaphor: bool
+    confidence: float
     
 class PredictionResponse(BaseModel):
     is_metaphor: bool
     confidence: float
+    # Per-window results in "window" mode
+    spans: Optional[List[MetaphorSpan]] = None
+    # True when the text was over the token budget and only its beginning was classified
+    truncated: bool = False
     
 class MaskingRequest(BaseModel):
     text: str
     top_k: Optional[int] = 5
+    # "independent": top_k per mask; "joint": also score combinations across masks
+    mode: Optional[Literal["independent", "joint"]] = "independent"
+    # Combinations kept by the joint beam search (capped at 20)
+    beam_size: int = Field(5, ge=1)
+
+class MaskCombination(BaseModel):
+    tokens: List[str]
+    score: float
     
 class MaskingResponse(BaseModel):
+    # Suggestions for the first [mask]
     suggestions: List[str]
+    # Suggestions for every [mask], in order
+    masks: List[List[str]] = []
+    combinations: List[MaskCombination] = []
+
+class BatchPredictionRequest(BaseModel):
+    texts: List[str]
+
+class BatchPredictionItem(BaseModel):
+    is_metaphor: Optional[bool] = None
+    confidence: Optional[float] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchPredictionItem]
+
+class BatchMaskingRequest(BaseModel):
+    texts: List[str]
+    top_k: Optional[int] = 5
+
+class BatchMaskingItem(BaseModel):
+    suggestions: Optional[List[str]] = None
+    error: Optional[str] = None
 
+class BatchMaskingResponse(BaseModel):
+    results: List[BatchMaskingItem]
+
+
+# Map emotion to style for the generate_metaphor function
+EMOTION_STYLES = {
+    "positive": "romantic",
+    "negative": "dark",
+    "neutral": "general"
+}
+
+# Metaphors whose estimated similarity reaches this are treated as duplicates (above 1 keeps near-duplicates)
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+def unique_in_order(items: List[str]) -> List[str]:
+    # Remove duplicates and near-duplicates if any
+    return dedupe_near_duplicates(items, DEDUP_THRESHOLD)
 
 # API Routes
 @app.post("/api/create-metaphors", response_model=MetaphorResponse)
 async def create_metaphors(request: MetaphorRequest):
     try:
-        # Map emotion to style for the generate_metaphor function
-        style_map = {
-            "positive": "romantic",
-            "negative": "dark",
-            "neutral": "general"
-        }
-        style = style_map.get(request.emotion, "general")
+        style = EMOTION_STYLES.get(request.emotion, "general")
+        deadline = request_deadline(request.deadline_ms)
         
         # Generate metaphors using source as topic, and target for context
-        metaphors = generate_metaphor(
+        metaphors = await inference.run(
+            "metaphor_creator",
+            generate_metaphor,
             topic=request.source, 
             style=style, 
             count=2,  # Generate 5 metaphors instead of 3
-            target=request.target
+            target=request.target,
+            deadline=deadline,
+            stop_at_sentence_end=METAPHOR_STOP_AT_SENTENCE_END
         )
         
-        # Remove duplicates if any
-        unique_metaphors = []
-        for m in metaphors:
-            if m not in unique_metaphors:
-                unique_metaphors.append(m)
-        
-        return {"metaphors": unique_metaphors}
+        return {"metaphors": unique_in_order(metaphors), "partial": deadline_hit(deadline)}
+    except QueueFullError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating metaphors: {str(e)}")
 
+@app.post("/api/create-metaphors/stream")
+async def create_metaphors_stream(request: MetaphorRequest, http_request: Request):
+    """
+    Server-Sent Events version of /api/create-metaphors: `token` events carry
+    text as it is generated, `end` closes one metaphor and `done` carries the
+    cleaned list.
+    """
+    style = EMOTION_STYLES.get(request.emotion, "general")
+    deadline = request_deadline(request.deadline_ms)
+    channel = TokenChannel()
+    job = inference.submit(
+        "metaphor_creator",
+        stream_metaphors,
+        topic=request.source,
+        style=style,
+        count=2,
+        target=request.target,
+        on_text=channel.on_text,
+        should_stop=channel.should_stop,
+        deadline=deadline,
+        stop_at_sentence_end=METAPHOR_STOP_AT_SENTENCE_END,
+    )
+    events = stream_events(http_request, channel, job,
+                           lambda metaphors: {"metaphors": unique_in_order(metaphors), "partial": deadline_hit(deadline)})
+    return StreamingResponse(events, media_type="text/event-stream")
+
 @app.post("/api/predict", response_model=PredictionResponse)
 async def predict_metaphor(request: PredictionRequest):
     try:
-        is_metaphor, confidence = classify_metaphor(request.text)
-        return {"is_metaphor": is_metaphor, "confidence": confidence}
+        text, mode, truncated = request.text, request.mode, False
+        
+        # A token is at least one character, so only long texts need counting
+        if len(text) + 2 > PREDICT_TOKEN_BUDGET:
+            tokens = await inference.run("metaphor_classifier", count_tokens, text)
+            if tokens > PREDICT_TOKEN_BUDGET:
+                if PREDICT_BUDGET_POLICY == "reject":
+                    raise HTTPException(status_code=413, detail=f"Text is {tokens} tokens, the limit is {PREDICT_TOKEN_BUDGET}")
+                text = await inference.run("metaphor_classifier", truncate_to_tokens, text, min(512, PREDICT_TOKEN_BUDGET))
+                mode, truncated = "truncate", True
+        
+        if mode == "window":
+            # Spans hold character offsets into this exact text, so it is not normalized for the key
+            key_options = dict(normalize=False, mode=mode, window_tokens=PREDICT_WINDOW_TOKENS)
+            key = result_key("metaphor_classifier", text, **key_options)
+            result = await result_cache.aget(key) if key is not None else None
+            if result is None:
+                result = await inference.run(
+                    "metaphor_classifier",
+                    classify_metaphor_windows,
+                    text,
+                    window_tokens=PREDICT_WINDOW_TOKENS,
+                    batch_size=BATCH_CHUNK_SIZE,
+                )
+                key = result_key("metaphor_classifier", text, **key_options)
+                if key is not None:
+                    await result_cache.aset(key, result)
+            return result
+        
+        key = result_key("metaphor_classifier", text)
+        cached = await result_cache.aget(key) if key is not None else None
+        if cached is not None:
+            is_metaphor, confidence = cached
+        else:
+            is_metaphor, confidence = await predict_batcher.submit(text)
+            key = result_key("metaphor_classifier", text)
+            if key is not None:
+                await result_cache.aset(key, [is_metaphor, confidence])
+        return {"is_metaphor": is_metaphor, "confidence": confidence, "truncated": truncated}
+    except (HTTPException, QueueFullError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error predicting metaphor: {str(e)}")
 
+@app.post("/api/predict/batch", response_model=BatchPredictionResponse)
+async def predict_metaphor_batch(request: BatchPredictionRequest):
+    if len(request.texts) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} texts per batch")
+    try:
+        outcomes = await run_cached_batch(
+            "metaphor_classifier",
+            request.texts,
+            partial(classify_metaphor_batch, batch_size=BATCH_CHUNK_SIZE),
+        )
+        results = []
+        for result, error in outcomes:
+            if error is not None:
+                results.append({"error": f"Error predicting metaphor: {error}"})
+            else:
+                is_metaphor, confidence = result
+                results.append({"is_metaphor": is_metaphor, "confidence": confidence})
+        return {"results": results}
+    except QueueFullError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error predicting metaphors: {str(e)}")
+
 class LyricsRequest(BaseModel):
     motion: str
     seed: Optional[str] = ""
+    count: Optional[int] = 3
+    max_lines: Optional[int] = None
+    deadline_ms: Optional[int] = None
 
 class LyricsResponse(BaseModel):
     lyrics: List[str]
+    # True when the deadline cut generation short
+    partial: bool = False
     # suggestions: Optional[List[str]] = None
 
+def lyrics_max_lines(request: LyricsRequest) -> int:
+    return LYRICS_MAX_LINES if request.max_lines is None else max(0, request.max_lines)
+
 @app.post("/api/generate-lyrics", response_model=LyricsResponse)
 async def create_lyrics(request: LyricsRequest):
     try:
         print(f"Received lyric request: Motion={request.motion}, Seed={request.seed}")
 
-        # generate main lyric
-        main_lyric = generate_lyrics_text(motion=request.motion, seed=request.seed)
+        count = max(1, min(LYRICS_MAX_COUNT, request.count or 1))
 
-        # generate 4 more lyrics (all considered as lyrics)
-        more_lyrics = [generate_lyrics_text(motion=request.motion, seed="") for _ in range(2)]
-
-        # combine all lyrics in a single list
-        all_lyrics = [main_lyric] + more_lyrics
+        # main lyric follows the seed, the rest start from the emotion alone;
+        # all of them come out of one batched generate call
+        seeds = [request.seed] + [""] * (count - 1)
+        deadline = request_deadline(request.deadline_ms)
+        all_lyrics = await inference.run("lyric_generator", generate_lyrics_batch, request.motion, seeds,
+                                         max_lines=lyrics_max_lines(request), deadline=deadline)
 
         print(f"Generated total {len(all_lyrics)} lyrics")
-        return {"lyrics": all_lyrics}
+        return {"lyrics": all_lyrics, "partial": deadline_hit(deadline)}
 
+    except QueueFullError:
+        raise
     except Exception as e:
         print(f"Error generating lyrics: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating lyrics: {str(e)}")
 
+@app.post("/api/generate-lyrics/stream")
+async def create_lyrics_stream(request: LyricsRequest, http_request: Request):
+    """
+    Server-Sent Events version of /api/generate-lyrics for a single lyric:
+    `token` events carry text as it is generated and `done` carries the lyric.
+    """
+    deadline = request_deadline(request.deadline_ms)
+    channel = TokenChannel()
+    job = inference.submit(
+        "lyric_generator",
+        stream_lyrics_text,
+        request.motion,
+        request.seed,
+        on_text=channel.on_text,
+        should_stop=channel.should_stop,
+        max_lines=lyrics_max_lines(request),
+        deadline=deadline,
+    )
+    events = stream_events(http_request, channel, job, lambda lyric: {"lyrics": [lyric], "partial": deadline_hit(deadline)})
+    return StreamingResponse(events, media_type="text/event-stream")
+
 @app.post("/api/predict-mask", response_model=MaskingResponse)
 async def predict_mask(request: MaskingRequest):
     try:
         if "[mask]" not in request.text:
             raise HTTPException(status_code=400, detail="Text must contain [mask] token")
         
-        suggestions = predict_masked_tokens(request.text, top_k=request.top_k)
+        joint = request.mode == "joint"
+        key_options = dict(top_k=request.top_k, joint=joint, beam_size=request.beam_size if joint else None)
+        key = result_key("masking_predict", request.text, **key_options)
+        result = await result_cache.aget(key) if key is not None else None
+        if result is None:
+            # All masks are filled from one forward pass
+            result = await inference.run(
+                "masking_predict",
+                predict_all_masks,
+                request.text,
+                top_k=request.top_k,
+                joint=joint,
+                beam_size=request.beam_size,
+            )
+            # Predefined suggestions served while the model fails must not outlive the failure
+            key = result_key("masking_predict", request.text, **key_options) if not result["fallback"] else None
+            if key is not None:
+                await result_cache.aset(key, result)
         
-        return {"suggestions": suggestions}
+        return {"suggestions": result["masks"][0], **result}
+    except (HTTPException, QueueFullError):
+        raise
     except Exception as e:
         print(f"Error predicting masked tokens: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error predicting masked tokens: {str(e)}")
 
+@app.post("/api/predict-mask/batch", response_model=BatchMaskingResponse)
+async def predict_mask_batch(request: BatchMaskingRequest):
+    if len(request.texts) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} texts per batch")
+    try:
+        masked = [text for text in request.texts if "[mask]" in text]
+        outcomes = iter(await run_cached_batch(
+            "masking_predict",
+            masked,
+            partial(predict_masked_tokens_batch, top_k=request.top_k, batch_size=BATCH_CHUNK_SIZE),
+            cacheable=lambda result: not result["fallback"],
+            top_k=request.top_k,
+        ))
+
+        results = []
+        for text in request.texts:
+            if "[mask]" not in text:
+                results.append({"error": "Text must contain [mask] token"})
+                continue
+            result, error = next(outcomes)
+            if error is not None:
+                results.append({"error": f"Error predicting masked tokens: {error}"})
+            else:
+                results.append({"suggestions": result["suggestions"]})
+        return {"results": results}
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error predicting masked tokens: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error predicting masked tokens: {str(e)}")
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "models": warmup.status_report()}
+
+@app.get("/models/memory")
+async def models_memory():
+    return registry.memory_report()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get("/readyz")
+async def readyz():
+    ready = warmup.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "models": warmup.status_report()},
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    for name, depth in inference.queue_depths().items():
+        metrics.QUEUE_DEPTH.set(depth, model=name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Song Analysis API"}
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
+    # Process mode is the production setup: one front-end process, no reloader
+    uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=os.getenv("SERVING_MODE", "threads") != "processes")
@@ -0,0 +1,272 @@
+"""
+Metrics
+This module records per-stage inference timings, token counts, fallback hits and queue depth,
+and renders them in the Prometheus text exposition format (no client library needed).
+"""
+import abc
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Timings recorded while serving the current request, for the Server-Timing header.
+# Worker pools copy the context, so stages timed in worker threads land in the same list.
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_timings", default=None)
+# Metric updates captured instead of applied, inside `recording()` (model worker processes)
+_recorded_updates: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("recorded_updates", default=None)
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _recorded(self, method: str, value: float, labels: Dict[str, str]) -> bool:
+        """Capture the update for `replay` instead of applying it, when inside `recording()`"""
+        updates = _recorded_updates.get()
+        if updates is None:
+            return False
+        updates.append((self.name, method, value, labels))
+        return True
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines in the text exposition format"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if self._recorded("inc", amount, labels):
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if self._recorded("set", value, labels):
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets, plus their sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        if self._recorded("observe", value, labels):
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+STAGE_SECONDS = Histogram("inference_stage_seconds", "Time spent in each inference stage", ["model", "stage"])
+INPUT_TOKENS = Histogram("inference_input_tokens", "Input tokens per sequence", ["model"], buckets=TOKEN_BUCKETS)
+GENERATED_TOKENS = Histogram("inference_generated_tokens", "Generated tokens per sequence", ["model"], buckets=TOKEN_BUCKETS)
+FALLBACKS = Counter("inference_fallback_total", "Results served from predefined fallbacks instead of the model", ["model", "kind"])
+PARTIAL_RESULTS = Counter("inference_partial_results_total", "Generations cut short by a request deadline", ["model"])
+QUEUE_DEPTH = Gauge("inference_queue_depth", "Requests running or waiting on a model's worker pool", ["model"])
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+
+
+@contextmanager
+def stage(model: str, name: str):
+    """Time a block as one stage of `model`'s inference"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, model=model, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((f"{model}.{name}", elapsed))
+
+
+def observe_tokens(model: str, input_counts: Iterable[int] = (), generated_counts: Iterable[int] = ()):
+    for count in input_counts:
+        INPUT_TOKENS.observe(count, model=model)
+    for count in generated_counts:
+        GENERATED_TOKENS.observe(count, model=model)
+
+
+def count_fallback(model: str, kind: str, amount: int = 1):
+    if amount:
+        FALLBACKS.inc(amount, model=model, kind=kind)
+
+
+def count_partial(model: str):
+    PARTIAL_RESULTS.inc(model=model)
+
+
+def request_timings() -> Optional[List[Tuple[str, float]]]:
+    """Stage timings of the request being served in this context, if any"""
+    return _request_timings.get()
+
+
+@contextmanager
+def recording():
+    """
+    Capture the metric updates and stage timings made inside the block
+    instead of applying them, so a model worker process can send them to the
+    server process to `replay`.
+    """
+    recorded = {"updates": [], "timings": []}
+    updates_token = _recorded_updates.set(recorded["updates"])
+    timings_token = _request_timings.set(recorded["timings"])
+    try:
+        yield recorded
+    finally:
+        _recorded_updates.reset(updates_token)
+        _request_timings.reset(timings_token)
+
+
+def replay(recorded: Dict[str, list], timings: Optional[List[Tuple[str, float]]] = None):
+    """Apply updates captured by `recording()`, adding its stage timings to a request's `timings`"""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, method, value, labels in recorded["updates"]:
+        getattr(metrics[name], method)(value, **labels)
+    if timings is not None:
+        timings.extend(recorded["timings"])
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing value with stages of the same name summed, in first-seen order"""
+    merged: Dict[str, float] = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in merged.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records request latency per route and, when
+    `server_timing` is set, adds a Server-Timing header with the stages timed
+    while handling the request. Streaming responses only include the stages
+    finished before their headers were sent.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = server_timing_header(timings, time.perf_counter() - start)
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            )
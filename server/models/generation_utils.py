@@ -0,0 +1,279 @@
+"""
+Generation Utilities
+This module holds helpers shared by the text-generation models (streaming and stopping hooks, prompt prefix caching).
+"""
+import abc
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import StoppingCriteria, TextStreamer
+
+
+class CallbackStreamer(TextStreamer):
+    """
+    Streamer that hands each decoded chunk of text to `on_text(text, stream_end)`
+    instead of printing it. `stream_end` is True once generation has finished.
+    """
+
+    def __init__(self, tokenizer, on_text: Callable[[str, bool], None], skip_prompt: bool = True, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        self.on_text(text, stream_end)
+
+
+class StopWhen(StoppingCriteria):
+    """Stops generation as soon as `should_stop()` returns True (e.g. the client went away)"""
+
+    def __init__(self, should_stop: Callable[[], bool]):
+        self.should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.should_stop()
+
+
+class Deadline(StoppingCriteria):
+    """
+    Stops generation once a wall-clock deadline has passed. Create it when the
+    request arrives, so time spent waiting for a worker counts too; `hit`
+    tells whether the deadline cut generation short.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.hit = False
+
+    @classmethod
+    def from_ms(cls, milliseconds: Optional[float]) -> Optional["Deadline"]:
+        """A deadline `milliseconds` from now, or None when it is unset or not positive"""
+        return cls(milliseconds / 1000) if milliseconds and milliseconds > 0 else None
+
+    def expired(self) -> bool:
+        if not self.hit and time.monotonic() >= self.expires_at:
+            self.hit = True
+        return self.hit
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.expired()
+
+
+# Sentence punctuation at the end of a token, possibly followed by closing quotes or brackets
+_SENTENCE_END_TOKEN = re.compile(r"[.!?][\"')\]]*\s*$")
+
+# Per-tokenizer vocabulary tables for the stopping criteria below; built once, dropped with the tokenizer
+_token_tables: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _token_table(tokenizer) -> Dict[str, torch.Tensor]:
+    """Boolean properties of every token's decoded text, indexed by token id"""
+    table = _token_tables.get(tokenizer)
+    if table is None:
+        # One id-to-token lookup for the whole vocabulary, then each token's text; much cheaper
+        # than decoding every id, which goes through the added-token handling per call
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        texts = [tokenizer.convert_tokens_to_string([token]) for token in tokens]
+        table = {
+            "sentence_end": torch.tensor([bool(_SENTENCE_END_TOKEN.search(text)) for text in texts]),
+            "newline": torch.tensor(["\n" in text for text in texts]),
+            "content": torch.tensor([bool(text.strip()) for text in texts]),
+            "content_before_newline": torch.tensor([bool(text.split("\n")[0].strip()) for text in texts]),
+            "content_after_newline": torch.tensor([bool(text.split("\n")[-1].strip()) for text in texts]),
+        }
+        _token_tables[tokenizer] = table
+    return table
+
+
+class _PerRowStoppingCriteria(StoppingCriteria):
+    """
+    Tracks which rows of a batch are finished, from the token each step adds,
+    and stops generation once all of them are. A row is also finished when it
+    produces the end-of-sequence token.
+    """
+
+    def __init__(self, tokenizer):
+        self.table = _token_table(tokenizer)
+        self.end_ids = torch.tensor([i for i in {tokenizer.eos_token_id, tokenizer.pad_token_id} if i is not None])
+        self.done: Optional[torch.Tensor] = None
+
+    @abc.abstractmethod
+    def _step(self, last_tokens: torch.Tensor) -> torch.Tensor:
+        """Per row, whether the token it just generated finishes it"""
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.done is None:
+            self.table = {name: values.to(input_ids.device) for name, values in self.table.items()}
+            self.end_ids = self.end_ids.to(input_ids.device)
+            self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        last_tokens = input_ids[:, -1]
+        self.done |= self._step(last_tokens) | torch.isin(last_tokens, self.end_ids)
+        return bool(self.done.all())
+
+
+class StopAtSentenceEnd(_PerRowStoppingCriteria):
+    """Stops once every row has generated a token that ends a sentence"""
+
+    def _step(self, last_tokens: torch.Tensor) -> torch.Tensor:
+        return self.table["sentence_end"][last_tokens]
+
+
+class StopAfterLines(_PerRowStoppingCriteria):
+    """Stops once every row has generated `max_lines` non-blank lines"""
+
+    def __init__(self, tokenizer, max_lines: int):
+        super().__init__(tokenizer)
+        self.max_lines = max_lines
+        self.lines: Optional[torch.Tensor] = None
+        # Whether the current line of each row has any text yet
+        self.line_open: Optional[torch.Tensor] = None
+
+    def _step(self, last_tokens: torch.Tensor) -> torch.Tensor:
+        if self.lines is None:
+            self.lines = torch.zeros_like(last_tokens)
+            self.line_open = torch.zeros_like(last_tokens, dtype=torch.bool)
+        newline = self.table["newline"][last_tokens]
+        closes_line = newline & (self.line_open | self.table["content_before_newline"][last_tokens])
+        self.lines += closes_line.long()
+        self.line_open = torch.where(newline, self.table["content_after_newline"][last_tokens],
+                                     self.line_open | self.table["content"][last_tokens])
+        return self.lines >= self.max_lines
+
+
+def generated_lengths(output_ids: torch.Tensor, input_length: int, pad_token_id: Optional[int]) -> List[int]:
+    """Number of new tokens per returned sequence (padding after an early stop is not counted)"""
+    new_tokens = output_ids[:, input_length:]
+    if pad_token_id is None:
+        return [new_tokens.shape[1]] * new_tokens.shape[0]
+    return (new_tokens != pad_token_id).sum(dim=1).tolist()
+
+
+def prompt_lengths(inputs) -> List[int]:
+    """Number of real (unpadded) prompt tokens per row of tokenized `generate` inputs"""
+    return inputs["attention_mask"].sum(dim=1).tolist()
+
+
+class PrefixCache:
+    """
+    Keeps the attention key/value state (past_key_values) of common prompt
+    prefixes, so generation only has to run the prefill over the rest of
+    each prompt.
+
+    Entries are tied to one model; call `clear()` when the model is unloaded.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[List[int], tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "PrefixCache":
+        """Size from PREFIX_CACHE_SIZE (entries per model; 0 disables the cache)"""
+        return cls(int(os.getenv("PREFIX_CACHE_SIZE", "32")))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _prefix_state(self, model, tokenizer, prefix: str) -> Tuple[List[int], tuple]:
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is not None:
+                self._entries.move_to_end(prefix)
+                self.hits += 1
+                return entry
+
+        ids = tokenizer(prefix)["input_ids"]
+        with torch.no_grad():
+            past = model(torch.tensor([ids], device=model.device), use_cache=True).past_key_values
+        entry = (ids, tuple((key, value) for key, value in past))
+
+        with self._lock:
+            self.misses += 1
+            self._entries[prefix] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def build_inputs(self, model, tokenizer, prompts: Sequence[str],
+                     prefixes: Sequence[Optional[str]]) -> Optional[Dict[str, object]]:
+        """
+        Build `generate` inputs that start from cached prefix state.
+
+        Each prompt may name a prefix (None for none); a prefix is only used
+        when the prompt's tokens really start with the prefix's tokens. Rows
+        are laid out as [pad][cached prefix][pad][rest of prompt], so cached
+        states of different lengths can share one batch. Everything but the
+        last prompt token is prefilled here; `generate` continues from there.
+
+        Returns:
+            input_ids, attention_mask and past_key_values for `model.generate`,
+            or None when no prompt can use a cached prefix
+        """
+        if self.max_entries <= 0:
+            return None
+
+        rows = []
+        for prompt, prefix in zip(prompts, prefixes):
+            ids = tokenizer(prompt)["input_ids"]
+            cached, past = 0, None
+            if prefix and len(ids) > 1:
+                prefix_ids, prefix_past = self._prefix_state(model, tokenizer, prefix)
+                if ids[:len(prefix_ids)] == prefix_ids:
+                    # The last prompt token is always left for generate to process
+                    cached = min(len(prefix_ids), len(ids) - 1)
+                    past = [(key[:, :, :cached], value[:, :, :cached]) for key, value in prefix_past]
+            rows.append((ids, cached, past))
+
+        cached_width = max(cached for _, cached, _ in rows)
+        if cached_width == 0:
+            return None
+        rest_width = max(len(ids) - cached for ids, cached, _ in rows)
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+        input_ids, attention_mask = [], []
+        for ids, cached, _ in rows:
+            rest = ids[cached:]
+            cached_pad, rest_pad = cached_width - cached, rest_width - len(rest)
+            input_ids.append([pad_id] * cached_pad + ids[:cached] + [pad_id] * rest_pad + rest)
+            attention_mask.append([0] * cached_pad + [1] * cached + [0] * rest_pad + [1] * len(rest))
+        input_ids = torch.tensor(input_ids, device=model.device)
+        attention_mask = torch.tensor(attention_mask, device=model.device)
+
+        # Stack the cached states, left-padding the shorter ones with masked-out zeros
+        template_past = next(row_past for _, _, row_past in rows if row_past is not None)
+        past = []
+        for layer in range(len(template_past)):
+            layer_state = []
+            for index in (0, 1):
+                template = template_past[layer][index]
+                padded = template.new_zeros(len(rows), template.shape[1], cached_width, template.shape[3])
+                for row, (_, cached, row_past) in enumerate(rows):
+                    if cached:
+                        padded[row, :, cached_width - cached:] = row_past[layer][index][0]
+                layer_state.append(padded)
+            past.append(tuple(layer_state))
+        past = tuple(past)
+
+        # Prefill the uncached part of each prompt except its last token
+        end = input_ids.shape[1] - 1
+        if end > cached_width:
+            position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+            with torch.no_grad():
+                past = model(
+                    input_ids[:, cached_width:end],
+                    past_key_values=past,
+                    attention_mask=attention_mask[:, :end],
+                    position_ids=position_ids[:, cached_width:end],
+                    use_cache=True,
+                ).past_key_values
+
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "past_key_values": past}
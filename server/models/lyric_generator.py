@@ -1,46 +1,171 @@
-from typing import Optional
+from typing import Callable, List, Optional
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import StoppingCriteriaList
 
-MODEL_NAME = "Vinushaanth/my-tamil-lyrics"
+from metrics import count_fallback, count_partial, observe_tokens, stage
+from models.generation_utils import (CallbackStreamer, Deadline, PrefixCache, StopAfterLines, StopWhen, generated_lengths,
+                                     prompt_lengths)
+from models.postprocess import first_lines
+from models.registry import registry
+
+# Model id, precision and device are configured in models/registry.py
+REGISTRY_NAME = "lyric_generator"
+MODEL_NAME = registry.spec(REGISTRY_NAME).model_id
 tokenizer = None
 model = None
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+device = registry.spec(REGISTRY_NAME).device
+
+# New tokens per lyric, counted after the prompt: a total max_length would be measured on the
+# left-padded batch and cut short the rows with shorter seeds (120 ~ the old 128-token total)
+MAX_NEW_TOKENS = 120
+
+# Attention state of the seedless "<emotion:...> <sep>" prompt per emotion, reused across requests
+prefix_cache = PrefixCache.from_env()
 
 def load_model():
     global tokenizer, model
     if tokenizer is None or model is None:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
-        model.to(device)
-        model.eval()
+        entry = registry.get(REGISTRY_NAME)
+        tokenizer, model = entry.tokenizer, entry.model
+
+def _unload():
+    global tokenizer, model
+    tokenizer, model = None, None
+    prefix_cache.clear()
+
+registry.on_evict(REGISTRY_NAME, _unload)
+
+def warmup():
+    """Run a tiny generation so the first real request does not pay for lazy initialisation"""
+    load_model()
+    inputs = tokenizer("<emotion:happy> <sep>", return_tensors="pt").to(device)
+    with torch.no_grad():
+        # With the request stopping criteria, so their vocabulary table is built now rather than on the first request
+        model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=tokenizer.eos_token_id,
+                       stopping_criteria=_stopping_criteria(1))
+
+def _build_prompt(motion: str, seed: Optional[str]) -> str:
+    return f"{seed or ' '} <emotion:{motion}> <sep>"
+
+def _prompt_inputs(motion: str, seeds: List[Optional[str]]):
+    """
+    Tokenized prompts for `generate`. The emotion scaffolding follows the seed,
+    so only seedless prompts (the whole prompt is the scaffolding) can start
+    from the cached state.
+    """
+    prompts = [_build_prompt(motion, seed) for seed in seeds]
+    try:
+        inputs = prefix_cache.build_inputs(model, tokenizer, prompts, [None if seed else prompt for seed, prompt in zip(seeds, prompts)])
+    except Exception as e:
+        print(f"Prefix cache unavailable: {str(e)}")
+        inputs = None
+    if inputs is None:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(device)
+    return inputs
+
+def _stopping_criteria(max_lines: int, *criteria) -> StoppingCriteriaList:
+    """Criteria for `generate`: the given ones that are set, plus stopping once every lyric has `max_lines` lines"""
+    criteria = [c for c in criteria if c is not None]
+    if max_lines > 0:
+        criteria.append(StopAfterLines(tokenizer, max_lines))
+    return StoppingCriteriaList(criteria)
+
+def _clean_lyric(generated_text: str, max_lines: int) -> str:
+    lyric = generated_text.split("<sep>")[-1].strip()
+    # Rows of a batch keep generating until the last one has enough lines
+    return first_lines(lyric, max_lines) if max_lines > 0 else lyric
 
 def generate_lyrics_text(motion: str, seed: Optional[str] = "") -> str:
+    return generate_lyrics_batch(motion, [seed])[0]
+
+def generate_lyrics_batch(motion: str, seeds: List[Optional[str]], num_samples: int = 1,
+                          max_lines: int = 0, deadline: Optional[Deadline] = None) -> List[str]:
+    """
+    Generate lyrics for several seeds in a single batched `generate` call.
+    
+    Args:
+        motion: Emotion tag passed to the model
+        seeds: Seed sentences; empty seeds let the model start from the emotion alone
+        num_samples: Number of lyrics sampled per seed
+        max_lines: Stop once every lyric has this many non-blank lines, and keep only those (0 for no limit)
+        deadline: Optional deadline; generation stops when it passes and
+            `deadline.hit` is set, returning the lyrics as far as they got
+    
+    Returns:
+        List of len(seeds) * num_samples lyrics, grouped by seed
+    """
     load_model()
-    seed = seed or " "
+    num_samples = max(1, num_samples)
 
     try:
-        # directly pass seed + emotion tags to model
-        input_text = f"{seed} <emotion:{motion}> <sep>"
-        inputs = tokenizer(input_text, return_tensors="pt").to(device)
+        # directly pass seed + emotion tags to model; each seed is repeated
+        # once per sample so cached prompt state lines up with the rows
+        with stage(REGISTRY_NAME, "prepare_inputs"):
+            inputs = _prompt_inputs(motion, [seed for seed in seeds for _ in range(num_samples)])
 
-        with torch.no_grad():
+        with stage(REGISTRY_NAME, "generate"), torch.no_grad():
             output_ids = model.generate(
                 **inputs,
-                max_length=128,
-                num_return_sequences=1,
+                max_new_tokens=MAX_NEW_TOKENS,
                 no_repeat_ngram_size=2,
                 do_sample=True,
                 top_k=50,
                 top_p=0.95,
-                temperature=1.0
+                temperature=1.0,
+                pad_token_id=tokenizer.pad_token_id,
+                stopping_criteria=_stopping_criteria(max_lines, deadline)
             )
 
-        generated_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        clean_text = generated_text.split("<sep>")[-1].strip()
+        observe_tokens(REGISTRY_NAME, prompt_lengths(inputs),
+                       generated_lengths(output_ids, inputs["input_ids"].shape[1], tokenizer.pad_token_id))
+        if deadline is not None and deadline.hit:
+            count_partial(REGISTRY_NAME)
 
-        return clean_text
+        with stage(REGISTRY_NAME, "decode"):
+            generated_texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+        with stage(REGISTRY_NAME, "postprocess"):
+            return [_clean_lyric(text, max_lines) for text in generated_texts]
 
     except Exception as e:
         print(f"Error generating lyrics: {str(e)}")
-        return f"Could not generate lyrics for {motion} mood.\nLa la la, sing along!"
+        count_fallback(REGISTRY_NAME, "error_message", len(seeds) * num_samples)
+        return [f"Could not generate lyrics for {motion} mood.\nLa la la, sing along!"] * (len(seeds) * num_samples)
+
+def stream_lyrics_text(motion: str, seed: Optional[str], on_text: Callable[[str, bool], None],
+                       should_stop: Callable[[], bool] = lambda: False, max_lines: int = 0,
+                       deadline: Optional[Deadline] = None) -> str:
+    """
+    Generate one lyric, passing decoded text to `on_text` as tokens are produced.
+    
+    Generation stops early once `should_stop()` returns True, `deadline` passes
+    or the lyric has `max_lines` non-blank lines.
+    
+    Returns:
+        The full cleaned lyric
+    """
+    load_model()
+
+    with stage(REGISTRY_NAME, "prepare_inputs"):
+        inputs = _prompt_inputs(motion, [seed])
+    streamer = CallbackStreamer(tokenizer, on_text, skip_prompt=True, skip_special_tokens=True)
+
+    with stage(REGISTRY_NAME, "generate"), torch.no_grad():
+        output_ids = model.generate(
+            **inputs,
+            max_new_tokens=MAX_NEW_TOKENS,
+            no_repeat_ngram_size=2,
+            do_sample=True,
+            top_k=50,
+            top_p=0.95,
+            temperature=1.0,
+            pad_token_id=tokenizer.pad_token_id,
+            streamer=streamer,
+            stopping_criteria=_stopping_criteria(max_lines, StopWhen(should_stop), deadline)
+        )
+
+    observe_tokens(REGISTRY_NAME, prompt_lengths(inputs),
+                   generated_lengths(output_ids, inputs["input_ids"].shape[1], tokenizer.pad_token_id))
+    if deadline is not None and deadline.hit:
+        count_partial(REGISTRY_NAME)
+    generated_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
+    return _clean_lyric(generated_text, max_lines)
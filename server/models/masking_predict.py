@@ -2,18 +2,22 @@
 Masking Predict Model
 This module predicts masked tokens in a sentence using Tamil-BERT fine-tuned model from Hugging Face.
 """
+import os
 import torch
-from typing import List
-from transformers import AutoTokenizer, AutoModelForMaskedLM, pipeline
-import re
+from typing import Dict, List, Optional, Tuple
+
+from metrics import count_fallback, observe_tokens, stage
+from models.registry import registry
+from models.suggestion_index import SuggestionIndex
 
 # Define the model for masked token prediction
-MODEL_NAME = "vimosh-v/tamil-bert-finetuned-v1"
+# The model id, its fallback (bert-base-multilingual-cased) and precision are configured in models/registry.py
+REGISTRY_NAME = "masking_predict"
+MODEL_NAME = registry.spec(REGISTRY_NAME).model_id
 
 # Initialize tokenizer and model (lazy loading - will load on first use)
 tokenizer = None
 model = None
-fill_mask_pipeline = None
 
 # Predefined suggestions for fallback
 PREDEFINED_SUGGESTIONS = {
@@ -30,24 +34,30 @@ PREDEFINED_SUGGESTIONS = {
     }
 }
 
+# Fallback lookups go through an index built once at import; MASK_SUGGESTIONS_LEXICON
+# points at an optional JSON/TSV file with additional context keys
+suggestion_index = SuggestionIndex.build(PREDEFINED_SUGGESTIONS, os.getenv("MASK_SUGGESTIONS_LEXICON"))
+
 def load_model():
     """Load the model and tokenizer if not already loaded"""
-    global tokenizer, model, fill_mask_pipeline
+    global tokenizer, model
     if tokenizer is None or model is None:
         try:
-            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-            model = AutoModelForMaskedLM.from_pretrained(MODEL_NAME)
-            fill_mask_pipeline = pipeline('fill-mask', model=model, tokenizer=tokenizer)
+            entry = registry.get(REGISTRY_NAME)
+            tokenizer, model = entry.tokenizer, entry.model
         except Exception as e:
             print(f"Error loading model: {str(e)}")
-            # Fall back to simpler model if specific model fails
-            try:
-                tokenizer = AutoTokenizer.from_pretrained("bert-base-multilingual-cased")
-                model = AutoModelForMaskedLM.from_pretrained("bert-base-multilingual-cased")
-                fill_mask_pipeline = pipeline('fill-mask', model=model, tokenizer=tokenizer)
-            except Exception as e2:
-                print(f"Error loading fallback model: {str(e2)}")
-                # No model loaded, will use predefined suggestions
+            # No model loaded, will use predefined suggestions
+
+def _unload():
+    global tokenizer, model
+    tokenizer, model = None, None
+
+registry.on_evict(REGISTRY_NAME, _unload)
+
+def warmup():
+    """Run a dummy prediction so the first real request does not pay for lazy initialisation"""
+    predict_masked_tokens("warm up [mask]", top_k=1)
 
 def predict_masked_tokens(sentence: str, top_k: int = 5) -> List[str]:
     """
@@ -60,15 +70,93 @@ def predict_masked_tokens(sentence: str, top_k: int = 5) -> List[str]:
     Returns:
         List of predicted words/tokens
     """
-    # Return empty list if no mask token
-    if "[mask]" not in sentence:
-        return []
+    return predict_masked_tokens_batch([sentence], top_k=top_k)[0]["suggestions"]
+
+def predict_masked_tokens_batch(sentences: List[str], top_k: int = 5, batch_size: int = 32) -> List[Dict]:
+    """
+    Predict the [mask] token for several sentences using padded forward passes.
     
+    Only the first [mask] in each sentence is filled. Sentences without a
+    [mask] token get an empty list.
+    
+    Args:
+        sentences: The input sentences, each with a [mask] token
+        top_k: Number of suggestions to return per sentence
+        batch_size: Maximum number of sentences per forward pass
+    
+    Returns:
+        Dict per sentence with "suggestions" (predicted words/tokens) and
+        "fallback" (True when they are predefined suggestions, not model output)
+    """
     # Limit top_k to reasonable range
     top_k = max(1, min(10, top_k))
     
-    # Determine if the sentence is Tamil or English
-    is_tamil = bool(re.search(r'[\u0B80-\u0BFF]', sentence))
+    results = []
+    for sentence, candidates in zip(sentences, _predict_mask_candidates(sentences, top_k, batch_size)):
+        if "[mask]" not in sentence:
+            results.append({"suggestions": [], "fallback": False})
+        elif candidates:
+            results.append({"suggestions": [token for token, _ in candidates[0]], "fallback": False})
+        else:
+            # Fall back to predefined suggestions
+            results.append({"suggestions": fallback_suggestions(sentence, top_k), "fallback": True})
+    return results
+
+def predict_all_masks(sentence: str, top_k: int = 5, joint: bool = False, beam_size: int = 5) -> Dict:
+    """
+    Fill every [mask] in a sentence from a single forward pass.
+    
+    Args:
+        sentence: The input sentence with one or more [mask] tokens
+        top_k: Number of suggestions to return per mask
+        joint: Also score combinations of tokens across all masks with a beam search
+        beam_size: Number of combinations kept by the joint beam search
+    
+    Returns:
+        Dict with "masks" (top_k suggestions per mask, in order),
+        "combinations" (best joint fillings with their summed log-probability;
+        empty unless `joint` is set and the model is available) and
+        "fallback" (True when the masks hold predefined suggestions)
+    """
+    # Limit top_k and beam_size to reasonable range
+    top_k = max(1, min(10, top_k))
+    beam_size = max(1, min(20, beam_size))
+    
+    mask_count = sentence.count("[mask]")
+    if mask_count == 0:
+        return {"masks": [], "combinations": [], "fallback": False}
+    
+    # The beam needs more than top_k candidates per mask to explore combinations
+    candidates = _predict_mask_candidates([sentence], max(top_k, beam_size) if joint else top_k)[0]
+    if not candidates:
+        # Fall back to predefined suggestions for every mask
+        return {"masks": [fallback_suggestions(sentence, top_k)] * mask_count, "combinations": [], "fallback": True}
+    
+    masks = [[token for token, _ in position[:top_k]] for position in candidates]
+    combinations = _beam_search(candidates, beam_size) if joint else []
+    return {"masks": masks, "combinations": combinations, "fallback": False}
+
+def _beam_search(candidates: List[List[Tuple[str, float]]], beam_size: int) -> List[Dict]:
+    """Best token combinations across mask positions, scored by summed log-probability"""
+    beams = [([], 0.0)]
+    for position in candidates:
+        expanded = [(tokens + [token], score + log_prob) for tokens, score in beams for token, log_prob in position]
+        expanded.sort(key=lambda beam: beam[1], reverse=True)
+        beams = expanded[:beam_size]
+    return [{"tokens": tokens, "score": score} for tokens, score in beams]
+
+def _predict_mask_candidates(sentences: List[str], top_k: int, batch_size: int = 32) -> List[Optional[List[List[Tuple[str, float]]]]]:
+    """
+    Run the masked-LM over the sentences in padded chunks.
+    
+    Returns:
+        Per sentence, a list with the top_k (token, log_probability) pairs for
+        each [mask] position, or None when the model is unavailable or failed
+    """
+    results = [None] * len(sentences)
+    masked = [i for i, sentence in enumerate(sentences) if "[mask]" in sentence]
+    if not masked:
+        return results
     
     # Try to load model if not already loaded
     try:
@@ -77,39 +165,47 @@ def predict_masked_tokens(sentence: str, top_k: int = 5) -> List[str]:
         print(f"Could not load model: {str(e)}")
         # Fall back to predefined suggestions based on context
     
+    if model is None:
+        return results
+    
     # Convert [mask] to model-specific mask token
-    if fill_mask_pipeline is not None:
+    mask_token = tokenizer.mask_token
+    batch_size = max(1, batch_size)
+    
+    for start in range(0, len(masked), batch_size):
+        chunk = masked[start:start + batch_size]
         try:
-            mask_token = tokenizer.mask_token
-            model_input = sentence.replace("[mask]", mask_token)
+            with stage(REGISTRY_NAME, "tokenize"):
+                model_inputs = [sentences[i].replace("[mask]", mask_token) for i in chunk]
+                inputs = tokenizer(model_inputs, return_tensors="pt", truncation=True, padding=True, max_length=512).to(model.device)
+            observe_tokens(REGISTRY_NAME, inputs["attention_mask"].sum(dim=1).tolist())
             
             # Get predictions from the model
-            predictions = fill_mask_pipeline(model_input, top_k=top_k)
+            with stage(REGISTRY_NAME, "forward"), torch.no_grad():
+                logits = model(**inputs).logits
             
-            # Extract the predicted tokens
-            if isinstance(predictions[0], list):
-                # Handle case where multiple masks return nested lists
-                predicted_tokens = [pred['token_str'] for pred in predictions[0]]
-            else:
-                predicted_tokens = [pred['token_str'] for pred in predictions]
-            
-            return predicted_tokens
+            with stage(REGISTRY_NAME, "decode"):
+                for row, index in enumerate(chunk):
+                    mask_positions = (inputs["input_ids"][row] == tokenizer.mask_token_id).nonzero(as_tuple=True)[0]
+                    if len(mask_positions) == 0:
+                        # Mask was truncated away
+                        continue
+                    
+                    # Extract the predicted tokens for every mask at once
+                    log_probs = torch.log_softmax(logits[row, mask_positions].float(), dim=-1)
+                    top = log_probs.topk(top_k, dim=-1)
+                    results[index] = [
+                        [(tokenizer.decode([token_id]), score) for token_id, score in zip(ids, scores)]
+                        for ids, scores in zip(top.indices.tolist(), top.values.tolist())
+                    ]
         except Exception as e:
             print(f"Error in prediction: {str(e)}")
             # Fall back to predefined suggestions
     
-    # Fallback: Use predefined suggestions based on context
-    if is_tamil:
-        # Check for Tamil context words
-        for key, suggestions in PREDEFINED_SUGGESTIONS["tamil"].items():
-            if key in sentence:
-                return suggestions[:top_k]
-        # Default Tamil suggestions if no context match
-        return PREDEFINED_SUGGESTIONS["tamil"]["செல்"][:top_k]
-    else:
-        # Check for English context words
-        for key, suggestions in PREDEFINED_SUGGESTIONS["english"].items():
-            if key in sentence:
-                return suggestions[:top_k]
-        # Default English suggestions if no context match
-        return PREDEFINED_SUGGESTIONS["english"]["go"][:top_k]
+    return results
+
+def fallback_suggestions(sentence: str, top_k: int = 5) -> List[str]:
+    """Use predefined suggestions based on context when the model is unavailable"""
+    count_fallback(REGISTRY_NAME, "predefined_suggestions")
+    with stage(REGISTRY_NAME, "fallback"):
+        return suggestion_index.lookup(sentence, top_k)
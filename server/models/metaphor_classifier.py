@@ -2,26 +2,43 @@
 Metaphor Classifier Model
 This module classifies text to determine if it contains metaphors using Hugging Face models.
 """
+import re
 import torch
-from typing import Tuple
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from typing import Dict, List, Tuple
+
+from metrics import observe_tokens, stage
+from models.registry import registry
 
 # Load pre-trained model and tokenizer for metaphor classification
 # Note: In a real implementation, you would use a model specifically fine-tuned for metaphor detection
 # This example uses a sentiment model as a placeholder - you would replace with an actual metaphor classifier
-MODEL_NAME = "vimosh-v/muril-large-metaphor"  # Replace with actual metaphor model
+# The model id and precision are configured in models/registry.py
+REGISTRY_NAME = "metaphor_classifier"
+MODEL_NAME = registry.spec(REGISTRY_NAME).model_id
     
 # Initialize tokenizer and model (lazy loading - will load on first use)
 tokenizer = None
 model = None
 
+# A sentence runs up to a line break or sentence-ending punctuation (including the Devanagari danda)
+SENTENCE_PATTERN = re.compile(r"[^\n.!?।]+[.!?।]*")
+
 def load_model():
     """Load the model and tokenizer if not already loaded"""
     global tokenizer, model
     if tokenizer is None or model is None:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-        model.eval()  # Set model to evaluation mode
+        entry = registry.get(REGISTRY_NAME)
+        tokenizer, model = entry.tokenizer, entry.model
+
+def _unload():
+    global tokenizer, model
+    tokenizer, model = None, None
+
+registry.on_evict(REGISTRY_NAME, _unload)
+
+def warmup():
+    """Run a dummy classification so the first real request does not pay for lazy initialisation"""
+    classify_metaphor_batch(["warm up"])
 
 def classify_metaphor(text: str) -> Tuple[bool, float]:
     """
@@ -33,21 +50,137 @@ def classify_metaphor(text: str) -> Tuple[bool, float]:
     Returns:
         Tuple of (is_metaphor, confidence_score)
     """
+    return classify_metaphor_batch([text])[0]
+
+def classify_metaphor_batch(texts: List[str], batch_size: int = 32) -> List[Tuple[bool, float]]:
+    """
+    Classify several texts using padded forward passes of up to `batch_size` texts.
+    
+    Texts are tokenized once and sorted by token length before chunking so similar
+    lengths end up in the same batch; results are returned in the original order.
+    
+    Args:
+        texts: The texts to analyze
+        batch_size: Maximum number of texts per forward pass
+        
+    Returns:
+        List of (is_metaphor, confidence_score) tuples, one per text
+    """
+    if not texts:
+        return []
+    
     # Load model if not already loaded
     load_model()
     
-    # Tokenize the input
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=512)
+    # Order by token length to keep padding to a minimum
+    with stage(REGISTRY_NAME, "tokenize"):
+        encoding = tokenizer(texts, truncation=True, max_length=512)
+    lengths = [len(ids) for ids in encoding["input_ids"]]
+    observe_tokens(REGISTRY_NAME, lengths)
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+    batch_size = max(1, batch_size)
+    
+    results = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        
+        # Pad the chunk's token ids from the single tokenization above
+        with stage(REGISTRY_NAME, "tokenize"):
+            features = {key: [values[i] for i in chunk] for key, values in encoding.items()}
+            inputs = tokenizer.pad(features, return_tensors="pt").to(model.device)
+        
+        # Get model prediction
+        with stage(REGISTRY_NAME, "forward"), torch.no_grad():
+            outputs = model(**inputs)
+            logits = outputs.logits
+            probabilities = torch.softmax(logits.float(), dim=1)
+        
+        # Get the confidence score for positive class (index 1)
+        # Note: In a real implementation, you would map the output to metaphor/non-metaphor
+        with stage(REGISTRY_NAME, "postprocess"):
+            confidences = probabilities[:, 1].tolist()
+        
+        for index, confidence in zip(chunk, confidences):
+            results[index] = (confidence > 0.5, confidence)
+    
+    return results
+
+def count_tokens(text: str) -> int:
+    """Number of tokens the model would see for `text` without truncation"""
+    load_model()
+    with stage(REGISTRY_NAME, "tokenize"):
+        return len(tokenizer(text, truncation=False, verbose=False)["input_ids"])
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` that fits in `max_tokens` tokens (special tokens included)"""
+    load_model()
+    with stage(REGISTRY_NAME, "tokenize"):
+        if tokenizer.is_fast:
+            encoding = tokenizer(text, truncation=True, max_length=max_tokens, return_offsets_mapping=True)
+            ends = [end for start, end in encoding["offset_mapping"] if end > start]
+            return text[:ends[-1]] if ends else ""
+        ids = tokenizer(text, truncation=True, max_length=max_tokens, add_special_tokens=False)["input_ids"]
+        return tokenizer.decode(ids[:max(0, max_tokens - 2)], skip_special_tokens=True)
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """Character (start, end) spans of the sentences or lines in `text`, without surrounding whitespace"""
+    spans = []
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+def classify_metaphor_windows(text: str, window_tokens: int = 128, overlap: int = 1, batch_size: int = 32) -> Dict:
+    """
+    Classify a long text as overlapping windows of whole sentences.
+    
+    Consecutive sentences are packed into windows of up to `window_tokens`
+    tokens; each window repeats the last `overlap` sentences of the previous
+    one so a metaphor spanning a sentence break is still seen whole. All
+    windows are classified as one batch.
+    
+    Args:
+        text: The text to analyze, e.g. a whole song
+        window_tokens: Maximum number of tokens per window
+        overlap: Number of sentences shared by consecutive windows
+        batch_size: Maximum number of windows per forward pass
     
-    # Get model prediction
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        probabilities = torch.softmax(logits, dim=1)
+    Returns:
+        Dict with "is_metaphor" and "confidence" for the whole text (from
+        its most metaphorical window) and "spans": every window's character
+        range, text, is_metaphor and confidence
+    """
+    load_model()
+    sentences = split_sentences(text) or [(0, len(text))]
+    with stage(REGISTRY_NAME, "tokenize"):
+        lengths = [len(ids) for ids in tokenizer([text[start:end] for start, end in sentences], add_special_tokens=False)["input_ids"]]
     
-    # Get the confidence score for positive class (index 1)
-    # Note: In a real implementation, you would map the output to metaphor/non-metaphor
-    confidence = probabilities[0][1].item()
-    is_metaphor = confidence > 0.5
+    # Greedily pack sentences into windows, always at least one sentence per window
+    windows = []
+    first = 0
+    while first < len(sentences):
+        last = first + 1
+        total = lengths[first]
+        while last < len(sentences) and total + lengths[last] <= window_tokens:
+            total += lengths[last]
+            last += 1
+        windows.append((sentences[first][0], sentences[last - 1][1]))
+        if last == len(sentences):
+            break
+        # Overlap only if the next window still has room for a new sentence
+        first = max(first + 1, last - overlap)
+        if sum(lengths[first:last]) + lengths[last] > window_tokens:
+            first = last
     
-    return is_metaphor, confidence
+    results = classify_metaphor_batch([text[start:end] for start, end in windows], batch_size=batch_size)
+    spans = [
+        {"start": start, "end": end, "text": text[start:end], "is_metaphor": is_metaphor, "confidence": confidence}
+        for (start, end), (is_metaphor, confidence) in zip(windows, results)
+    ]
+    confidence = max(span["confidence"] for span in spans)
+    return {"is_metaphor": confidence > 0.5, "confidence": confidence, "spans": spans}
@@ -3,18 +3,41 @@ Metaphor Creator Model
 This module generates creative metaphors based on a given topic and style using Hugging Face models.
 """
 import torch
-from typing import List
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from typing import Callable, List, Optional, Tuple
+from transformers import StoppingCriteriaList
 import random
 
+from metrics import count_fallback, count_partial, observe_tokens, stage
+from models.generation_utils import (CallbackStreamer, Deadline, PrefixCache, StopAtSentenceEnd, StopWhen, generated_lengths,
+                                     prompt_lengths)
+from models.postprocess import clean_generations, first_sentence
+from models.registry import registry
+
 # Define the model for text generation
 # We're using GPT-2 as an example, but you could use a more advanced model like T5, BART, or GPT-3
-MODEL_NAME = "gpt2"  # You can use more advanced models like "gpt2-large" or "EleutherAI/gpt-neo-1.3B"
+# The model id and precision are configured in models/registry.py (METAPHOR_CREATOR_MODEL to override)
+REGISTRY_NAME = "metaphor_creator"
+MODEL_NAME = registry.spec(REGISTRY_NAME).model_id
 
 # Initialize tokenizer and model (lazy loading - will load on first use)
 tokenizer = None
 model = None
-generator = None
+
+# Attention state of the fixed instruction prefix of each style, reused across requests
+prefix_cache = PrefixCache.from_env()
+
+# New tokens generated per metaphor. A fixed count rather than a total length, so a prompt
+# gets the same budget whether it runs alone or left-padded in a batch with longer ones
+# (36 is what the previous 50-token total left a typical prompt)
+MAX_NEW_TOKENS = 36
+
+# Instruction every prompt of a style starts with
+STYLE_PREFIXES = {
+    "romantic": "Create a beautiful metaphor comparing",
+    "dark": "Create a deep metaphor comparing",
+    "nature": "Create a nature metaphor comparing",
+    "general": "Create a profound metaphor comparing",
+}
 
 # Predefined metaphors for better quality when model fails
 PREDEFINED_METAPHORS = {
@@ -43,37 +66,53 @@ PREDEFINED_METAPHORS = {
 
 def load_model():
     """Load the model and tokenizer if not already loaded"""
-    global tokenizer, model, generator
+    global tokenizer, model
     if tokenizer is None or model is None:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
-        generator = pipeline('text-generation', model=model, tokenizer=tokenizer)
+        entry = registry.get(REGISTRY_NAME)
+        tokenizer, model = entry.tokenizer, entry.model
 
-def generate_metaphor(topic: str, style: str = "general", count: int = 3, target: str = None) -> List[str]:
-    """
-    Generate creative metaphors based on the given topic and style using a Hugging Face model.
-    
-    Args:
-        topic: The subject of the metaphor
-        style: Style category (general, romantic, nature)
-        count: Number of metaphors to generate
-        target: Optional target domain to relate the metaphor to
-    
-    Returns:
-        List of generated metaphors
-    """
-    # Map style to emotion for predefined metaphors
+def _unload():
+    global tokenizer, model
+    tokenizer, model = None, None
+    prefix_cache.clear()
+
+registry.on_evict(REGISTRY_NAME, _unload)
+
+def warmup():
+    """Run a tiny generation so the first real request does not pay for lazy initialisation"""
+    load_model()
+    inputs = tokenizer("Warm up", return_tensors="pt").to(model.device)
+    with torch.no_grad():
+        # With the request stopping criteria, so their vocabulary table is built now rather than on the first request
+        model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=tokenizer.eos_token_id,
+                       stopping_criteria=_stopping_criteria(True))
+
+def _style_emotion(style: str) -> str:
+    """Map style to emotion for predefined metaphors"""
     emotion_map = {
         "romantic": "positive",
         "dark": "negative",
         "general": "neutral",
         "nature": "positive"
     }
-    emotion = emotion_map.get(style, "neutral")
-    
-    # Load model if not already loaded
-    load_model()
-    
+    return emotion_map.get(style, "neutral")
+
+def _style_prefix(style: str) -> str:
+    return STYLE_PREFIXES.get(style, STYLE_PREFIXES["general"])
+
+def _prompt_inputs(prompts: List[str], style: str):
+    """Tokenized prompts for `generate`, starting from the cached style prefix when possible"""
+    try:
+        inputs = prefix_cache.build_inputs(model, tokenizer, prompts, [_style_prefix(style)] * len(prompts))
+    except Exception as e:
+        print(f"Prefix cache unavailable: {str(e)}")
+        inputs = None
+    if inputs is None:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    return inputs
+
+def _build_prompts(topic: str, style: str, count: int, target: str = None) -> List[Tuple[str, str]]:
+    """Build up to five (prompt, target) pairs for the requested style"""
     # Limit count to reasonable range
     count = max(1, min(5, count))
     
@@ -98,89 +137,149 @@ def generate_metaphor(topic: str, style: str = "general", count: int = 3, target
         targets = [target] * count
     
     # Create prompts based on style and whether target is provided
+    prefix = _style_prefix(style)
     prompts = []
     for i in range(count):
         current_target = targets[i % len(targets)]
-        if style == "romantic":
-            prompt = f"Create a beautiful metaphor comparing {topic} to {current_target}. {topic} is like"
-        elif style == "dark":
-            prompt = f"Create a deep metaphor comparing {topic} to {current_target}. {topic} is like"
-        elif style == "nature":
-            prompt = f"Create a nature metaphor comparing {topic} to {current_target}. {topic} is like"
+        if style in ("romantic", "dark", "nature"):
+            prompt = f"{prefix} {topic} to {current_target}. {topic} is like"
         else:  # general
-            prompt = f"Create a profound metaphor comparing {topic} to {current_target}. {topic} is"
+            prompt = f"{prefix} {topic} to {current_target}. {topic} is"
         
         prompts.append((prompt, current_target))
     
-    # Generate metaphors
-    metaphors = []
-    for prompt, current_target in prompts:
-        try:
-            # Generate text with the model
-            output = generator(
-                prompt,
-                max_length=50,
+    return prompts
+
+def _stopping_criteria(stop_at_sentence_end: bool, *criteria) -> StoppingCriteriaList:
+    """Criteria for `generate`: the given ones that are set, plus stopping once every metaphor has ended its sentence"""
+    criteria = [c for c in criteria if c is not None]
+    if stop_at_sentence_end:
+        criteria.append(StopAtSentenceEnd(tokenizer))
+    return StoppingCriteriaList(criteria)
+
+def generate_metaphor(topic: str, style: str = "general", count: int = 3, target: str = None,
+                      deadline: Optional[Deadline] = None, stop_at_sentence_end: bool = True) -> List[str]:
+    """
+    Generate creative metaphors based on the given topic and style using a Hugging Face model.
+    
+    Args:
+        topic: The subject of the metaphor
+        style: Style category (general, romantic, nature)
+        count: Number of metaphors to generate
+        target: Optional target domain to relate the metaphor to
+        deadline: Optional deadline; generation stops when it passes and
+            `deadline.hit` is set (cut-off metaphors are cleaned or replaced as usual)
+        stop_at_sentence_end: Stop generating once every metaphor has ended its first sentence,
+            and keep only that sentence
+    
+    Returns:
+        List of generated metaphors
+    """
+    emotion = _style_emotion(style)
+    
+    # Load model if not already loaded
+    load_model()
+    
+    prompts = _build_prompts(topic, style, count, target)
+    
+    # Generate all metaphors in one padded batch
+    try:
+        with stage(REGISTRY_NAME, "prepare_inputs"):
+            inputs = _prompt_inputs([prompt for prompt, _ in prompts], style)
+        with stage(REGISTRY_NAME, "generate"), torch.no_grad():
+            output_ids = model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
                 num_return_sequences=1,
                 temperature=0.9,
                 top_p=0.92,
                 do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
+                pad_token_id=tokenizer.pad_token_id,
+                stopping_criteria=_stopping_criteria(stop_at_sentence_end, deadline)
             )
-            
-            # Extract and clean up the generated text
-            generated_text = output[0]['generated_text']
-            
-            # Process the generated text to extract just the metaphor
-            if " is like " in generated_text:
-                start_idx = generated_text.find(" is like ") + 8
-                metaphor = generated_text[start_idx:].strip()
-                
-                # Clean up: remove repetitive words and limit length
-                words = metaphor.split()
-                cleaned_words = []
-                prev_word = None
-                repetition_count = 0
-                
-                for word in words:
-                    if word == prev_word:
-                        repetition_count += 1
-                        if repetition_count > 2:  # Allow max 2 repetitions
-                            continue
-                    else:
-                        repetition_count = 0
-                    
-                    cleaned_words.append(word)
-                    prev_word = word
-                
-                metaphor = " ".join(cleaned_words)
-                
-                # Truncate to first 20 words to keep it concise
-                if len(cleaned_words) > 20:
-                    metaphor = " ".join(cleaned_words[:20])
-                
-                # Ensure it ends with proper punctuation
-                if not metaphor.endswith('.') and not metaphor.endswith('!') and not metaphor.endswith('?'):
-                    metaphor = metaphor + '.'
-                
-                formatted_metaphor = f"{topic} is like {metaphor}"
-                
-                # Check if the metaphor makes sense
-                if len(formatted_metaphor.split()) < 5 or len(formatted_metaphor) < 20:
-                    # Use predefined metaphor if generated one is too short
-                    template = random.choice(PREDEFINED_METAPHORS[emotion])
-                    formatted_metaphor = template.format(source=topic, target=current_target)
-                
-                metaphors.append(formatted_metaphor)
-            else:
-                # Use predefined metaphor as fallback
-                template = random.choice(PREDEFINED_METAPHORS[emotion])
-                formatted_metaphor = template.format(source=topic, target=current_target)
-                metaphors.append(formatted_metaphor)
-            
-        except Exception as e:
-            # Fallback to predefined metaphor
-            template = random.choice(PREDEFINED_METAPHORS[emotion])
-            formatted_metaphor = template.format(source=topic, target=current_target)
-            metaphors.append(formatted_metaphor)
+        observe_tokens(REGISTRY_NAME, prompt_lengths(inputs),
+                       generated_lengths(output_ids, inputs["input_ids"].shape[1], tokenizer.pad_token_id))
+        with stage(REGISTRY_NAME, "decode"):
+            generated_texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    except Exception as e:
+        print(f"Error generating metaphors: {str(e)}")
+        generated_texts = [""] * len(prompts)
+    if deadline is not None and deadline.hit:
+        count_partial(REGISTRY_NAME)
+    
+    with stage(REGISTRY_NAME, "postprocess"):
+        return _extract_metaphors(generated_texts, topic, [current_target for _, current_target in prompts], emotion,
+                                  stop_at_sentence_end)
+
+def stream_metaphors(topic: str, style: str = "general", count: int = 3, target: str = None,
+                     on_text: Callable[[str, bool], None] = None, should_stop: Callable[[], bool] = lambda: False,
+                     deadline: Optional[Deadline] = None, stop_at_sentence_end: bool = True) -> List[str]:
+    """
+    Generate metaphors one prompt at a time, passing decoded text to `on_text`
+    as tokens are produced. `on_text(text, True)` marks the end of each metaphor.
     
+    Generation stops early once `should_stop()` returns True or `deadline` passes.
+    
+    Returns:
+        List of cleaned metaphors generated before stopping
+    """
+    emotion = _style_emotion(style)
+    load_model()
+    
+    metaphors = []
+    for prompt, current_target in _build_prompts(topic, style, count, target):
+        if should_stop() or (deadline is not None and deadline.expired()):
+            break
+        
+        with stage(REGISTRY_NAME, "prepare_inputs"):
+            inputs = _prompt_inputs([prompt], style)
+        streamer = CallbackStreamer(tokenizer, on_text, skip_prompt=True, skip_special_tokens=True)
+        with stage(REGISTRY_NAME, "generate"), torch.no_grad():
+            output_ids = model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=0.9,
+                top_p=0.92,
+                do_sample=True,
+                pad_token_id=tokenizer.pad_token_id,
+                streamer=streamer,
+                stopping_criteria=_stopping_criteria(stop_at_sentence_end, StopWhen(should_stop), deadline)
+            )
+        observe_tokens(REGISTRY_NAME, prompt_lengths(inputs),
+                       generated_lengths(output_ids, inputs["input_ids"].shape[1], tokenizer.pad_token_id))
+        generated_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
+        with stage(REGISTRY_NAME, "postprocess"):
+            metaphors.extend(_extract_metaphors([generated_text], topic, [current_target], emotion, stop_at_sentence_end))
+    if deadline is not None and deadline.hit:
+        count_partial(REGISTRY_NAME)
+    
+    return metaphors
+
+def _predefined_metaphor(topic: str, current_target: str, emotion: str) -> str:
+    template = random.choice(PREDEFINED_METAPHORS[emotion])
+    return template.format(source=topic, target=current_target)
+
+def _extract_metaphors(generated_texts: List[str], topic: str, targets: List[str], emotion: str,
+                       single_sentence: bool = False) -> List[str]:
+    """Turn a batch of raw model outputs into clean metaphors, falling back to predefined ones"""
+    # Process the generated text to extract just the metaphor
+    bodies = [text[text.find(" is like ") + 8:].strip() if " is like " in text else None for text in generated_texts]
+    if single_sentence:
+        # Rows of a batch keep generating until the last one ends its sentence
+        bodies = [first_sentence(body) if body is not None else None for body in bodies]
+    try:
+        # Clean up: remove repetitive words, keep the first 20 words and fix the punctuation
+        cleaned = clean_generations([body or "" for body in bodies], max_words=20, max_repeats=2)
+    except Exception as e:
+        print(f"Error cleaning metaphors: {str(e)}")
+        cleaned = [None] * len(bodies)
+    
+    metaphors = []
+    for body, metaphor, current_target in zip(bodies, cleaned, targets):
+        formatted_metaphor = f"{topic} is like {metaphor}"
+        # Use predefined metaphor as fallback, or if the generated one is too short
+        if body is None or metaphor is None or len(formatted_metaphor.split()) < 5 or len(formatted_metaphor) < 20:
+            count_fallback(REGISTRY_NAME, "predefined_metaphor")
+            formatted_metaphor = _predefined_metaphor(topic, current_target, emotion)
+        metaphors.append(formatted_metaphor)
     return metaphors
@@ -0,0 +1,149 @@
+"""
+ONNX Runtime Backend
+This module exports encoder models (sequence classification, masked LM) to ONNX and runs them
+with ONNX Runtime behind the same `model(**inputs).logits` interface as the PyTorch models.
+
+onnxruntime (and onnx, for int8 quantization) are optional and only imported when this backend is used.
+"""
+import inspect
+import json
+import os
+from typing import Dict, Optional
+
+import torch
+from transformers import AutoTokenizer
+
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model.int8.onnx"
+METADATA_FILE = "export.json"
+DEFAULT_OPSET = 14
+
+# Inputs the exported graphs can accept
+ENCODER_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+class OnnxOutput:
+    def __init__(self, logits: torch.Tensor):
+        self.logits = logits
+
+
+class OnnxModel:
+    """
+    An ONNX Runtime session that can stand in for a Hugging Face encoder model
+    in the model modules: it is called with tokenizer output and returns an
+    object with `.logits` as a torch tensor. Runs on CPU.
+    """
+
+    def __init__(self, path: str, threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.device = torch.device("cpu")
+        self.weights_bytes = os.path.getsize(path)
+
+    def __call__(self, **inputs) -> OnnxOutput:
+        feed = {name: inputs[name].cpu().numpy().astype("int64") for name in self.input_names if name in inputs}
+        if "token_type_ids" in self.input_names and "token_type_ids" not in feed:
+            feed["token_type_ids"] = feed["input_ids"] * 0
+        logits = self.session.run(["logits"], feed)[0]
+        return OnnxOutput(torch.from_numpy(logits))
+
+    def eval(self) -> "OnnxModel":
+        return self
+
+    def to(self, *args, **kwargs) -> "OnnxModel":
+        return self
+
+
+def model_file(directory: str, precision: str = "fp32") -> str:
+    """The exported graph to serve: the int8 one when requested and present"""
+    int8_path = os.path.join(directory, INT8_MODEL_FILE)
+    if precision == "int8" and os.path.exists(int8_path):
+        return int8_path
+    return os.path.join(directory, MODEL_FILE)
+
+
+def load_onnx(directory: str, precision: str = "fp32", threads: Optional[int] = None):
+    """
+    Load an exported model directory.
+
+    Returns:
+        (tokenizer, OnnxModel)
+    """
+    path = model_file(directory, precision)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No exported ONNX model at {path}; run `python -m scripts.export_onnx` first")
+    return AutoTokenizer.from_pretrained(directory), OnnxModel(path, threads)
+
+
+def export_onnx(model: torch.nn.Module, tokenizer, output_dir: str, source_id: str,
+                opset: int = DEFAULT_OPSET, int8: bool = False) -> Dict[str, str]:
+    """
+    Export an encoder model to ONNX with dynamic batch and sequence axes,
+    save the ONNX Runtime-optimized graph and the tokenizer next to it, and
+    optionally a dynamically quantized int8 copy.
+
+    Returns:
+        Dict with the paths written
+    """
+    import onnxruntime as ort
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.float().eval()
+    model.config.return_dict = True
+
+    sample = tokenizer(["a short sample", "a slightly longer sample sentence"], return_tensors="pt", padding=True)
+    # Positional export arguments must follow the order of forward()'s parameters
+    parameters = list(inspect.signature(model.forward).parameters)
+    input_names = sorted((name for name in ENCODER_INPUTS if name in sample and name in parameters), key=parameters.index)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    with torch.no_grad():
+        logits_rank = model(**{name: sample[name] for name in input_names}).logits.dim()
+    # Classifier logits are (batch, labels); masked-LM logits are (batch, sequence, vocab)
+    dynamic_axes["logits"] = {0: "batch", 1: "sequence"} if logits_rank == 3 else {0: "batch"}
+
+    raw_path = os.path.join(output_dir, "model.raw.onnx")
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer PyTorch defaults to the dynamo exporter; the TorchScript one handles dynamic_axes as written
+        export_kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            raw_path,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+            **export_kwargs,
+        )
+
+    # Let ONNX Runtime fuse the graph once and keep the result, so serving loads the optimized model.
+    # EXTENDED rather than ALL: the saved graph must not depend on this machine's CPU layout.
+    path = os.path.join(output_dir, MODEL_FILE)
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = path
+    ort.InferenceSession(raw_path, options, providers=["CPUExecutionProvider"])
+
+    written = {"model": path}
+    if int8:
+        # Quantize the unfused graph: the quantizer cannot type ONNX Runtime's fused contrib operators
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        written["int8_model"] = os.path.join(output_dir, INT8_MODEL_FILE)
+        quantize_dynamic(raw_path, written["int8_model"], weight_type=QuantType.QInt8)
+    os.remove(raw_path)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump({"source_model": source_id, "opset": opset, "inputs": input_names, "int8": int8}, f, indent=2)
+    written["tokenizer"] = output_dir
+    return written
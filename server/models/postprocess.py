@@ -0,0 +1,132 @@
+"""
+Text Post-processing
+This module cleans and deduplicates batches of generated text with numpy,
+instead of per-word Python loops for every output.
+"""
+import re
+import unicodedata
+import zlib
+from typing import List
+
+import numpy as np
+
+# MinHash over character shingles; the permutations are fixed so signatures are stable across processes
+MINHASH_PERMUTATIONS = 64
+SHINGLE_SIZE = 4
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32, so a * hash + b stays below 2**64
+_rng = np.random.default_rng(20240501)
+_HASH_A = _rng.integers(1, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+SENTENCE_END = (".", "!", "?")
+_FIRST_SENTENCE = re.compile(r".*?[.!?][\"')\]]*(?=\s|$)", re.DOTALL)
+
+
+def clean_generations(texts: List[str], max_words: int = 20, max_repeats: int = 2) -> List[str]:
+    """
+    Clean a batch of generated texts in one pass.
+
+    Runs of the same word are cut to the first occurrence plus `max_repeats`
+    repetitions, each text is truncated to `max_words` words and closed with
+    a full stop if it does not already end with sentence punctuation.
+
+    Args:
+        texts: Raw generated texts
+        max_words: Maximum number of words kept per text
+        max_repeats: Maximum number of immediate repetitions of a word
+
+    Returns:
+        Cleaned texts, in the same order
+    """
+    split = [text.split() for text in texts]
+    lengths = np.array([len(words) for words in split])
+    if lengths.sum() == 0:
+        return [_close_sentence("") for _ in texts]
+
+    # Flatten the batch: one array of words and the index of the text each came from
+    words = np.array([word for words_ in split for word in words_], dtype=object)
+    doc = np.repeat(np.arange(len(texts)), lengths)
+
+    # A run starts wherever the word or the text changes
+    run_start = np.ones(len(words), dtype=bool)
+    run_start[1:] = (words[1:] != words[:-1]) | (doc[1:] != doc[:-1])
+    run_start_index = np.maximum.accumulate(np.where(run_start, np.arange(len(words)), 0))
+    keep = np.arange(len(words)) - run_start_index <= max_repeats
+
+    # Position of each kept word within its text, for truncation
+    kept_doc = doc[keep]
+    kept_words = words[keep]
+    doc_offsets = np.searchsorted(kept_doc, np.arange(len(texts)))
+    position = np.arange(len(kept_doc)) - doc_offsets[kept_doc]
+    within_limit = position < max_words
+    kept_doc = kept_doc[within_limit]
+    kept_words = kept_words[within_limit]
+
+    bounds = np.searchsorted(kept_doc, np.arange(len(texts) + 1))
+    return [_close_sentence(" ".join(kept_words[bounds[i]:bounds[i + 1]])) for i in range(len(texts))]
+
+
+def _close_sentence(text: str) -> str:
+    # Ensure it ends with proper punctuation
+    return text if text.endswith(SENTENCE_END) else text + "."
+
+
+def first_sentence(text: str) -> str:
+    """The text up to and including its first sentence punctuation (the whole text if there is none)"""
+    match = _FIRST_SENTENCE.match(text)
+    return match.group(0).strip() if match else text
+
+
+def first_lines(text: str, max_lines: int) -> str:
+    """The first `max_lines` non-blank lines of a text"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    return "\n".join(lines[:max_lines])
+
+
+def normalize_for_dedup(text: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a text"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def minhash_signatures(texts: List[str], shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """MinHash signature (one row per text) over character shingles of the normalized texts"""
+    signatures = np.full((len(texts), MINHASH_PERMUTATIONS), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for row, text in enumerate(texts):
+        shingles = {text[i:i + shingle_size] for i in range(max(1, len(text) - shingle_size + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        signatures[row] = ((np.outer(hashes, _HASH_A) + _HASH_B) % _PRIME).min(axis=0)
+    return signatures
+
+
+def dedupe_near_duplicates(texts: List[str], threshold: float = 0.8) -> List[str]:
+    """
+    Drop texts that repeat an earlier one, keeping the first occurrence.
+
+    Texts are duplicates when their normalized forms are equal, or when the
+    estimated Jaccard similarity of their character shingles is at least
+    `threshold` (a threshold above 1 disables near-duplicate matching).
+
+    Args:
+        texts: Texts in preference order
+        threshold: Minimum estimated similarity for two texts to count as duplicates
+
+    Returns:
+        The texts that are kept, in their original order
+    """
+    if len(texts) < 2:
+        return list(texts)
+
+    normalized = [normalize_for_dedup(text) for text in texts]
+    signatures = minhash_signatures(normalized)
+    similarity = (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+
+    kept = []
+    seen = set()
+    for i, key in enumerate(normalized):
+        if key in seen or (kept and similarity[i, kept].max() >= threshold):
+            continue
+        seen.add(key)
+        kept.append(i)
+    return [texts[i] for i in kept]
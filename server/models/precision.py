@@ -0,0 +1,65 @@
+"""
+Inference Precision
+This module converts loaded models to a reduced-precision mode for cheaper CPU serving.
+"""
+import torch
+from transformers.pytorch_utils import Conv1D
+
+# fp32: full precision (default)
+# bf16: bfloat16 weights and activations
+# int8: dynamic int8 quantization of Linear layers (CPU only; GPT-2 Conv1D layers are converted to Linear first)
+PRECISION_MODES = ("fp32", "bf16", "int8")
+
+
+def conv1d_to_linear(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Replace GPT-2 style Conv1D layers with equivalent nn.Linear layers, in place.
+
+    Conv1D stores its weight as (in_features, out_features), so dynamic quantization
+    (which only knows nn.Linear) would otherwise skip every attention and MLP projection.
+
+    Args:
+        model: A loaded model
+
+    Returns:
+        The same model with its Conv1D layers replaced
+    """
+    for parent in list(model.modules()):
+        for child_name, child in list(parent.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, device=child.weight.device, dtype=child.weight.dtype)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                linear.bias.copy_(child.bias)
+            setattr(parent, child_name, linear)
+    return model
+
+
+def apply_precision(model: torch.nn.Module, mode: str = "fp32", device: torch.device = torch.device("cpu")) -> torch.nn.Module:
+    """
+    Return `model` converted to the requested precision mode.
+
+    Args:
+        model: A loaded model in eval mode
+        mode: One of PRECISION_MODES
+        device: Device the model will run on
+
+    Returns:
+        The converted model (may be a new object for int8)
+    """
+    mode = (mode or "fp32").lower()
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision mode '{mode}', expected one of {', '.join(PRECISION_MODES)}")
+
+    if mode == "bf16":
+        return model.to(torch.bfloat16)
+
+    if mode == "int8":
+        if device.type != "cpu":
+            print(f"Dynamic int8 quantization only runs on CPU; keeping fp32 on {device}")
+            return model
+        return torch.quantization.quantize_dynamic(conv1d_to_linear(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+    return model
@@ -0,0 +1,378 @@
+"""
+Model Registry
+This module is the single place where models are configured, loaded, placed on a device and evicted.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+import torch
+from transformers import (AutoModelForCausalLM, AutoModelForMaskedLM, AutoModelForSequenceClassification,
+                          AutoTokenizer)
+
+from models.onnx_backend import load_onnx
+from models.precision import apply_precision
+
+
+def _env(name: str, key: str, default: Optional[str]) -> Optional[str]:
+    return os.getenv(f"{name.upper()}_{key}", default)
+
+
+class ModelSpec:
+    """
+    How to load one model. Every field can be overridden with environment
+    variables named after the model, e.g. METAPHOR_CLASSIFIER_MODEL,
+    METAPHOR_CLASSIFIER_PRECISION, METAPHOR_CLASSIFIER_DEVICE.
+
+    When MODEL_STORE is set, a snapshot in MODEL_STORE/<name> (written by
+    `python -m scripts.snapshot_models`) is loaded before trying the hub.
+    """
+
+    def __init__(self, name: str, model_id: str, model_class, fallback_ids: Iterable[str] = (),
+                 precision: str = "fp32", device: str = "cpu", left_padding: bool = False, onnx_export: bool = False):
+        self.name = name
+        self.model_class = model_class
+        self.model_id = _env(name, "MODEL", model_id)
+        fallback = _env(name, "FALLBACK_MODEL", None)
+        if fallback is not None:
+            fallback_ids = [fallback] if fallback else []
+        self.fallback_ids: List[str] = list(fallback_ids)
+        # Hub revision (branch, tag or commit) to load and snapshot
+        self.revision = _env(name, "REVISION", None)
+        store = os.getenv("MODEL_STORE")
+        self.store_path = os.path.join(store, name) if store else None
+        self.precision = _env(name, "PRECISION", precision)
+        self.device = torch.device(_env(name, "DEVICE", os.getenv("DEVICE", device)))
+        # Generation models batch prompts with left padding
+        self.left_padding = left_padding
+        # Encoder models can be served from an ONNX export instead (<NAME>_BACKEND=onnx)
+        self.onnx_export = onnx_export
+        self.backend = _env(name, "BACKEND", "torch") if onnx_export else "torch"
+        self.onnx_path = _env(name, "ONNX_PATH", os.path.join(os.getenv("ONNX_DIR", "onnx_models"), name))
+        # Intra-op threads for ONNX Runtime sessions (unset: ONNX Runtime's default)
+        threads = _env(name, "THREADS", None)
+        self.threads = int(threads) if threads else None
+
+    def to_dict(self) -> Dict:
+        return {
+            "model_id": self.model_id,
+            "fallback_ids": self.fallback_ids,
+            "precision": self.precision,
+            "device": str(self.device),
+            "backend": self.backend,
+            "revision": self.revision,
+            "store_path": self.store_path,
+        }
+
+
+class ModelEntry:
+    """A loaded tokenizer/model pair and what it cost to load"""
+
+    def __init__(self, tokenizer, model, model_id: str, load_seconds: float, rss_delta_bytes: int,
+                 loaded_from: Optional[str] = None, backend: str = "torch", precision: str = "fp32",
+                 revision: Optional[str] = None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.model_id = model_id
+        # Hub id or local directory the weights were read from
+        self.loaded_from = loaded_from or model_id
+        self.load_seconds = load_seconds
+        self.rss_delta_bytes = rss_delta_bytes
+        # What actually serves requests, which can differ from the spec after a fallback
+        self.backend = backend
+        self.precision = precision
+        self.revision = revision
+
+    def identity(self) -> Dict:
+        """Everything about the loaded model that can change its outputs"""
+        return {
+            "model_id": self.model_id,
+            "backend": self.backend,
+            "precision": self.precision,
+            "revision": self.revision,
+        }
+
+
+def tensor_bytes(model: torch.nn.Module) -> int:
+    """Bytes held by a model's weights and buffers, including quantized packed weights"""
+    if not isinstance(model, torch.nn.Module):
+        # ONNX Runtime sessions report the size of their graph file
+        return getattr(model, "weights_bytes", 0)
+    total = 0
+    for value in model.state_dict().values():
+        values = value if isinstance(value, (tuple, list)) else [value]
+        for tensor in values:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def has_meta_tensors(model: torch.nn.Module) -> bool:
+    """True if any weight or buffer was left without data (on the meta device)"""
+    return any(tensor.is_meta for tensor in itertools.chain(model.parameters(), model.buffers()))
+
+
+def retie_decoder_bias(model: torch.nn.Module):
+    """
+    Re-tie masked-LM head decoder biases to the head's own bias (as the head's __init__ does).
+    The tied copy is saved only once, so a low_cpu_mem_usage load leaves it on the meta device.
+    """
+    for module in model.modules():
+        decoder, bias = getattr(module, "decoder", None), getattr(module, "bias", None)
+        if (isinstance(decoder, torch.nn.Linear) and decoder.bias is not None and decoder.bias.is_meta
+                and isinstance(bias, torch.nn.Parameter) and not bias.is_meta):
+            decoder.bias = bias
+
+
+class SharedExclusiveLock:
+    """Any number of holders in shared mode at once, or a single holder in exclusive mode"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and self._shared == 0)
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+def process_memory() -> Dict[str, int]:
+    """Resident memory of this process; shared vs private split where /proc provides it"""
+    report = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    report[key] = int(value.split()[0]) * 1024
+        return {
+            "rss_bytes": report.get("Rss", 0),
+            "shared_bytes": report.get("Shared_Clean", 0) + report.get("Shared_Dirty", 0),
+            "private_bytes": report.get("Private_Clean", 0) + report.get("Private_Dirty", 0),
+        }
+    except OSError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return {"rss_bytes": int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")}
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux
+        return {"rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def read_snapshot(path: str) -> Optional[Dict]:
+    """Metadata of the model snapshot in `path`, or None if there is none"""
+    try:
+        with open(os.path.join(path, SNAPSHOT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Loads each registered model at most once per process and hands out the
+    shared instance. Call `preload()` before forking worker processes so the
+    weights are shared copy-on-write between them.
+    """
+
+    def __init__(self):
+        self.specs: Dict[str, ModelSpec] = {}
+        self._entries: Dict[str, ModelEntry] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        # low_cpu_mem_usage patches torch.nn.Module process-wide while it builds a model on
+        # the meta device, so those loads run alone; other model loads run side by side
+        self._model_load_lock = SharedExclusiveLock()
+        self._evict_callbacks: Dict[str, List[Callable[[], None]]] = {}
+
+    def register(self, spec: ModelSpec):
+        self.specs[spec.name] = spec
+        self._locks.setdefault(spec.name, threading.Lock())
+        self._evict_callbacks.setdefault(spec.name, [])
+
+    def spec(self, name: str) -> ModelSpec:
+        return self.specs[name]
+
+    def on_evict(self, name: str, callback: Callable[[], None]):
+        """Run `callback` when `name` is evicted, so modules can drop their references"""
+        self._evict_callbacks[name].append(callback)
+
+    def loaded(self, name: str) -> Optional[ModelEntry]:
+        return self._entries.get(name)
+
+    def identity(self, name: str) -> Optional[Dict]:
+        """Identity of the loaded model for `name`, or None while it is not loaded"""
+        entry = self._entries.get(name)
+        return entry.identity() if entry is not None else None
+
+    def get(self, name: str) -> ModelEntry:
+        """Return the loaded model, loading it first if needed (thread-safe)"""
+        entry = self._entries.get(name)
+        if entry is not None:
+            return entry
+        # Concurrent first requests must not load the model twice
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._load(self.specs[name])
+                self._entries[name] = entry
+            return entry
+
+    def evict(self, name: str):
+        """Drop a model so its memory can be reclaimed; the next `get` reloads it"""
+        with self._locks[name]:
+            self._entries.pop(name, None)
+            for callback in self._evict_callbacks[name]:
+                callback()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def preload(self, names: Optional[Iterable[str]] = None, max_workers: int = 4):
+        """Load several models concurrently; failures are printed, not raised"""
+        names = list(names or self.specs)
+
+        def load(name: str):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Error preloading {name}: {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="preload") as pool:
+            list(pool.map(load, names))
+
+    def memory_report(self) -> Dict:
+        models = {}
+        for name, spec in self.specs.items():
+            entry = self._entries.get(name)
+            report = {"loaded": entry is not None, **spec.to_dict()}
+            if entry is not None:
+                report.update({
+                    "loaded_model_id": entry.model_id,
+                    "loaded_from": entry.loaded_from,
+                    "load_seconds": entry.load_seconds,
+                    "weights_bytes": tensor_bytes(entry.model),
+                    "rss_delta_bytes": entry.rss_delta_bytes,
+                })
+            models[name] = report
+        return {"process": process_memory(), "models": models}
+
+    def _load(self, spec: ModelSpec) -> ModelEntry:
+        errors = []
+        if spec.backend == "onnx":
+            rss_before = process_memory()["rss_bytes"]
+            start = time.perf_counter()
+            try:
+                tokenizer, model = load_onnx(spec.onnx_path, spec.precision, spec.threads)
+                return ModelEntry(
+                    tokenizer,
+                    model,
+                    model.path,
+                    load_seconds=round(time.perf_counter() - start, 3),
+                    rss_delta_bytes=max(0, process_memory()["rss_bytes"] - rss_before),
+                    backend="onnx",
+                    precision=spec.precision,
+                )
+            except Exception as e:
+                # Serve the PyTorch model rather than nothing
+                print(f"Error loading ONNX model for {spec.name}, using PyTorch: {str(e)}")
+                errors.append(f"{spec.onnx_path}: {str(e)}")
+
+        # (model id or path, from_pretrained options for tokenizer and model, extra model options)
+        candidates = [(model_id, {"revision": spec.revision}, {}) for model_id in [spec.model_id] + spec.fallback_ids]
+        snapshot = read_snapshot(spec.store_path) if spec.store_path else None
+        if snapshot is not None:
+            if snapshot["source_model"] in [spec.model_id] + spec.fallback_ids:
+                # Local safetensors snapshot: no hub lookups, weights memory-mapped instead of read into a copy
+                candidates.insert(0, (spec.store_path, {"local_files_only": True}, {"low_cpu_mem_usage": True, "use_safetensors": True}))
+            else:
+                print(f"Ignoring snapshot of {snapshot['source_model']} in {spec.store_path}: {spec.name} is configured as {spec.model_id}")
+
+        for model_id, options, model_options in candidates:
+            rss_before = process_memory()["rss_bytes"]
+            start = time.perf_counter()
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(model_id, **options)
+                low_cpu_mem_usage = model_options.get("low_cpu_mem_usage", False)
+                with self._model_load_lock.exclusive() if low_cpu_mem_usage else self._model_load_lock.shared():
+                    model = spec.model_class.from_pretrained(model_id, **options, **model_options)
+                if low_cpu_mem_usage:
+                    retie_decoder_bias(model)
+                    if has_meta_tensors(model):
+                        print(f"Warning: {model_id} left weights on the meta device, loading it again without low_cpu_mem_usage")
+                        with self._model_load_lock.shared():
+                            model = spec.model_class.from_pretrained(model_id, **options, use_safetensors=True)
+                model.to(spec.device)
+                model.eval()
+                model = apply_precision(model, spec.precision, spec.device)
+            except Exception as e:
+                print(f"Error loading model {model_id}: {str(e)}")
+                errors.append(f"{model_id}: {str(e)}")
+                continue
+
+            if spec.left_padding:
+                # Batched generation needs left padding so every prompt ends right before the new tokens
+                tokenizer.padding_side = "left"
+                if tokenizer.pad_token is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+
+            loaded_from = model_id
+            if model_id == spec.store_path:
+                model_id = f"{snapshot['source_model']}@{snapshot['revision']}" if snapshot.get("revision") else snapshot["source_model"]
+            elif model_id != spec.model_id:
+                print(f"Loaded fallback model {model_id} for {spec.name}")
+            return ModelEntry(
+                tokenizer,
+                model,
+                model_id,
+                load_seconds=round(time.perf_counter() - start, 3),
+                rss_delta_bytes=max(0, process_memory()["rss_bytes"] - rss_before),
+                loaded_from=loaded_from,
+                precision=spec.precision,
+                # The hub commit the weights resolved to, when known
+                revision=getattr(model.config, "_commit_hash", None) or spec.revision,
+            )
+
+        raise RuntimeError(f"Could not load {spec.name}: {'; '.join(errors)}")
+
+
+registry = ModelRegistry()
+
+_default_device = "cuda" if torch.cuda.is_available() else "cpu"
+
+registry.register(ModelSpec("metaphor_creator", "gpt2", AutoModelForCausalLM, left_padding=True))
+registry.register(ModelSpec("metaphor_classifier", "vimosh-v/muril-large-metaphor", AutoModelForSequenceClassification,
+                            onnx_export=True))
+registry.register(ModelSpec("lyric_generator", "Vinushaanth/my-tamil-lyrics", AutoModelForCausalLM,
+                            device=_default_device, left_padding=True))
+registry.register(ModelSpec("masking_predict", "vimosh-v/tamil-bert-finetuned-v1", AutoModelForMaskedLM,
+                            fallback_ids=["bert-base-multilingual-cased"], onnx_export=True))
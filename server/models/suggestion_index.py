@@ -0,0 +1,145 @@
+"""
+Suggestion Index
+This module looks up predefined masked-word suggestions by context keyword with an Aho-Corasick automaton,
+so fallback lookups cost the same whether the lexicon holds ten entries or tens of thousands.
+"""
+import csv
+import json
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TAMIL_PATTERN = re.compile(r'[\u0B80-\u0BFF]')
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher. Patterns keep the order they were added
+    in; `first_match` returns the earliest-added pattern found anywhere in the
+    text in a single pass over it.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        # Trie as parallel lists: transitions, failure links and the best
+        # (lowest) pattern priority reachable through each node's output chain
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[Optional[int]] = [None]
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        if not pattern:
+            return
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = next_node
+        if self._best[node] is None:
+            self._best[node] = len(self.patterns)
+        self.patterns.append(pattern)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def first_match(self, text: str) -> Optional[str]:
+        """Earliest-added pattern that occurs in `text`, or None"""
+        best = None
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            priority = self._best[node]
+            if priority is not None and (best is None or priority < best):
+                best = priority
+                if best == 0:
+                    break
+        return self.patterns[best] if best is not None else None
+
+
+class SuggestionIndex:
+    """
+    Predefined suggestions per language, indexed by context keyword.
+
+    The lexicon maps language -> {context key: [suggestions]}; the first key
+    of each language is used when nothing in the sentence matches.
+    """
+
+    def __init__(self, lexicon: Dict[str, Dict[str, List[str]]]):
+        self.lexicon = lexicon
+        self.defaults = {language: next(iter(entries)) for language, entries in lexicon.items() if entries}
+        self.matchers = {language: AhoCorasick(entries) for language, entries in lexicon.items()}
+
+    def lookup(self, sentence: str, top_k: int = 5) -> List[str]:
+        # Determine if the sentence is Tamil or English
+        language = "tamil" if TAMIL_PATTERN.search(sentence) else "english"
+        entries = self.lexicon.get(language)
+        if not entries:
+            return []
+
+        key = self.matchers[language].first_match(sentence) or self.defaults[language]
+        return entries[key][:top_k]
+
+    @classmethod
+    def build(cls, builtin: Dict[str, Dict[str, List[str]]], lexicon_path: Optional[str] = None) -> "SuggestionIndex":
+        """Index the built-in suggestions, extended with an external lexicon file if given"""
+        lexicon = {language: dict(entries) for language, entries in builtin.items()}
+        if lexicon_path:
+            try:
+                entries = load_lexicon(lexicon_path)
+            except (OSError, ValueError) as e:
+                print(f"Error loading suggestion lexicon {lexicon_path}: {str(e)}")
+                entries = []
+            for language, key, suggestions in entries:
+                if not key or not suggestions:
+                    continue
+                # Built-in entries keep their priority; external ones only add new keys
+                lexicon.setdefault(language, {}).setdefault(key, suggestions)
+        return cls(lexicon)
+
+
+def load_lexicon(path: str) -> List[Tuple[str, str, List[str]]]:
+    """
+    Read (language, key, suggestions) entries from a lexicon file.
+
+    JSON files use the PREDEFINED_SUGGESTIONS layout:
+        {"tamil": {"செல்": ["செல்கிறேன்", ...]}, "english": {...}}
+    TSV files have one entry per line:
+        language<TAB>key<TAB>suggestion 1<TAB>suggestion 2 ...
+    """
+    entries = []
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for language, keys in data.items():
+            for key, suggestions in keys.items():
+                entries.append((language, key, list(suggestions)))
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.reader(f, delimiter="\t"):
+                if len(row) < 3 or row[0].startswith("#"):
+                    continue
+                entries.append((row[0].strip(), row[1].strip(), [s.strip() for s in row[2:] if s.strip()]))
+    return entries
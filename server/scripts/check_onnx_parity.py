@@ -0,0 +1,84 @@
+"""
+ONNX Parity Check
+Runs the ONNX exports and the PyTorch models on the same samples and compares their outputs,
+so the onnx backend can be switched on knowing it answers like PyTorch.
+
+Usage (from the server directory, after `python -m scripts.export_onnx`):
+    python -m scripts.check_onnx_parity
+    python -m scripts.check_onnx_parity --models masking_predict --precision int8
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+import torch
+
+from models.onnx_backend import load_onnx
+from models.registry import registry
+from scripts.check_precision_drift import SAMPLE_MASKED, SAMPLE_TEXTS
+
+CHECKED = [name for name, spec in registry.specs.items() if spec.onnx_export]
+
+
+def compare(name: str, precision: str, top_k: int = 5) -> Dict[str, float]:
+    spec = registry.spec(name)
+    tokenizer, onnx_model = load_onnx(spec.onnx_path, precision)
+    with open(f"{spec.onnx_path}/export.json", encoding="utf-8") as f:
+        source_id = json.load(f)["source_model"]
+    torch_model = spec.model_class.from_pretrained(source_id).eval()
+
+    if name == "masking_predict":
+        texts = [s.replace("[mask]", tokenizer.mask_token) for s in SAMPLE_MASKED]
+    else:
+        texts = SAMPLE_TEXTS
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=512)
+    with torch.no_grad():
+        expected = torch_model(**inputs).logits.float()
+    actual = onnx_model(**inputs).logits.float()
+
+    if name == "masking_predict":
+        # Compare at the first mask of each sentence
+        positions = [(ids == tokenizer.mask_token_id).nonzero(as_tuple=True)[0][0] for ids in inputs["input_ids"]]
+        expected = torch.stack([expected[row, position] for row, position in enumerate(positions)])
+        actual = torch.stack([actual[row, position] for row, position in enumerate(positions)])
+
+    # The classifier only has two labels
+    top_k = min(top_k, expected.shape[-1])
+    expected_top = expected.topk(top_k, dim=-1).indices
+    actual_top = actual.topk(top_k, dim=-1).indices
+    return {
+        "max_abs_logit_diff": (expected - actual).abs().max().item(),
+        "agreement": (expected_top[:, 0] == actual_top[:, 0]).float().mean().item(),
+        "mean_topk_overlap": sum(len(set(e.tolist()) & set(a.tolist())) / top_k
+                                 for e, a in zip(expected_top, actual_top)) / len(texts),
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare ONNX Runtime outputs against PyTorch")
+    parser.add_argument("--models", nargs="+", choices=CHECKED, default=CHECKED)
+    parser.add_argument("--precision", choices=["fp32", "int8"], default="fp32")
+    parser.add_argument("--max-logit-diff", type=float, default=1e-3,
+                        help="Maximum allowed absolute logit difference (fp32 exports only)")
+    parser.add_argument("--min-agreement", type=float, default=1.0,
+                        help="Minimum fraction of samples whose top prediction must match PyTorch")
+    args = parser.parse_args(argv)
+
+    report = {}
+    passed = True
+    for name in args.models:
+        metrics = compare(name, args.precision)
+        ok = metrics["agreement"] >= args.min_agreement
+        if args.precision == "fp32":
+            ok = ok and metrics["max_abs_logit_diff"] <= args.max_logit_diff
+        metrics["passed"] = ok
+        report[name] = metrics
+        passed = passed and ok
+
+    print(json.dumps({"precision": args.precision, "models": report}, indent=2))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
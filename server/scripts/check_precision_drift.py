@@ -0,0 +1,148 @@
+"""
+Precision Drift Check
+Compares reduced-precision models (bf16 / int8) against fp32 on a fixed sample set,
+so a precision mode can be switched on with known accuracy impact.
+
+Usage (from the server directory):
+    python -m scripts.check_precision_drift --mode int8
+    python -m scripts.check_precision_drift --mode bf16 --models metaphor_classifier masking_predict
+"""
+import argparse
+import copy
+import json
+import sys
+from typing import Dict, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoModelForMaskedLM, AutoModelForSequenceClassification, AutoTokenizer
+
+from models import lyric_generator, masking_predict, metaphor_classifier, metaphor_creator
+from models.precision import PRECISION_MODES, apply_precision
+
+SAMPLE_TEXTS = [
+    "Life is a journey",
+    "The sky is blue today",
+    "Her smile is the sunrise of my morning",
+    "He walked to the market to buy vegetables",
+    "Time is a thief that steals our youth",
+    "The meeting starts at ten o'clock",
+    "நீ என் வாழ்வின் ஒளி",
+    "அவள் கண்கள் கடல் போல ஆழமானவை",
+    "நான் பள்ளிக்கு செல்கிறேன்",
+    "மழை பெய்கிறது",
+]
+
+SAMPLE_MASKED = [
+    "I want to [mask] to the beach",
+    "She [mask] a book yesterday",
+    "We [mask] dinner together every night",
+    "நான் பள்ளிக்கு [mask]",
+    "அவன் புத்தகம் [mask]",
+    "அவர் உணவு [mask]",
+]
+
+SAMPLE_PROMPTS = [
+    "Create a beautiful metaphor comparing love to ocean. love is like",
+    "Create a deep metaphor comparing loneliness to night. loneliness is like",
+    "  <emotion:happy> <sep>",
+    "மழை <emotion:sad> <sep>",
+]
+
+MODELS = {
+    "metaphor_classifier": (metaphor_classifier, AutoModelForSequenceClassification),
+    "masking_predict": (masking_predict, AutoModelForMaskedLM),
+    "metaphor_creator": (metaphor_creator, AutoModelForCausalLM),
+    "lyric_generator": (lyric_generator, AutoModelForCausalLM),
+}
+
+
+def compare_classifier(tokenizer, base, candidate, texts: List[str]) -> Dict[str, float]:
+    """Drift in positive-class probability and label agreement"""
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=512)
+    with torch.no_grad():
+        base_probs = torch.softmax(base(**inputs).logits.float(), dim=1)[:, 1]
+        cand_probs = torch.softmax(candidate(**inputs).logits.float(), dim=1)[:, 1]
+    drift = (base_probs - cand_probs).abs()
+    return {
+        "max_confidence_drift": drift.max().item(),
+        "mean_confidence_drift": drift.mean().item(),
+        "agreement": ((base_probs > 0.5) == (cand_probs > 0.5)).float().mean().item(),
+    }
+
+
+def compare_masked_lm(tokenizer, base, candidate, sentences: List[str], top_k: int = 5) -> Dict[str, float]:
+    """Top-1 agreement and top-k overlap at the first mask of each sentence"""
+    inputs = tokenizer([s.replace("[mask]", tokenizer.mask_token) for s in sentences], return_tensors="pt", padding=True)
+    with torch.no_grad():
+        base_logits = base(**inputs).logits.float()
+        cand_logits = candidate(**inputs).logits.float()
+
+    top1_matches, overlaps = [], []
+    for row in range(len(sentences)):
+        position = (inputs["input_ids"][row] == tokenizer.mask_token_id).nonzero(as_tuple=True)[0][0]
+        base_top = base_logits[row, position].topk(top_k).indices.tolist()
+        cand_top = cand_logits[row, position].topk(top_k).indices.tolist()
+        top1_matches.append(float(base_top[0] == cand_top[0]))
+        overlaps.append(len(set(base_top) & set(cand_top)) / top_k)
+    return {
+        "agreement": sum(top1_matches) / len(top1_matches),
+        "mean_topk_overlap": sum(overlaps) / len(overlaps),
+    }
+
+
+def compare_causal_lm(tokenizer, base, candidate, prompts: List[str]) -> Dict[str, float]:
+    """Greedy next-token agreement and KL divergence of the next-token distribution"""
+    top1_matches, divergences = [], []
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            base_log_probs = torch.log_softmax(base(**inputs).logits[0, -1].float(), dim=-1)
+            cand_log_probs = torch.log_softmax(candidate(**inputs).logits[0, -1].float(), dim=-1)
+        top1_matches.append(float(base_log_probs.argmax() == cand_log_probs.argmax()))
+        divergences.append(torch.sum(base_log_probs.exp() * (base_log_probs - cand_log_probs)).item())
+    return {
+        "agreement": sum(top1_matches) / len(top1_matches),
+        "mean_kl_divergence": sum(divergences) / len(divergences),
+    }
+
+
+def check_model(name: str, mode: str) -> Dict[str, float]:
+    module, model_class = MODELS[name]
+    tokenizer = AutoTokenizer.from_pretrained(module.MODEL_NAME)
+    base = model_class.from_pretrained(module.MODEL_NAME).eval()
+    candidate = apply_precision(copy.deepcopy(base), mode)
+
+    if name == "metaphor_classifier":
+        return compare_classifier(tokenizer, base, candidate, SAMPLE_TEXTS)
+    if name == "masking_predict":
+        return compare_masked_lm(tokenizer, base, candidate, SAMPLE_MASKED)
+    return compare_causal_lm(tokenizer, base, candidate, SAMPLE_PROMPTS)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare reduced-precision model outputs against fp32")
+    parser.add_argument("--mode", choices=[m for m in PRECISION_MODES if m != "fp32"], default="int8")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--min-agreement", type=float, default=0.9,
+                        help="Minimum fraction of samples whose top prediction must match fp32")
+    parser.add_argument("--max-confidence-drift", type=float, default=0.05,
+                        help="Maximum allowed change in classifier confidence")
+    args = parser.parse_args(argv)
+
+    report = {}
+    passed = True
+    for name in args.models:
+        metrics = check_model(name, args.mode)
+        ok = metrics["agreement"] >= args.min_agreement
+        if "max_confidence_drift" in metrics:
+            ok = ok and metrics["max_confidence_drift"] <= args.max_confidence_drift
+        metrics["passed"] = ok
+        report[name] = metrics
+        passed = passed and ok
+
+    print(json.dumps({"mode": args.mode, "models": report}, indent=2))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+ONNX Export
+Exports the encoder models (metaphor classifier, masked LM) to ONNX with ONNX Runtime graph optimizations,
+for serving with <MODEL>_BACKEND=onnx.
+
+Usage (from the server directory):
+    python -m scripts.export_onnx
+    python -m scripts.export_onnx --models masking_predict --int8
+    python -m scripts.export_onnx --output-dir /srv/onnx_models
+
+Models are exported to <output-dir>/<model name>, the default location the registry loads from
+(ONNX_DIR, or <MODEL>_ONNX_PATH per model).
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+from transformers import AutoTokenizer
+
+from models.onnx_backend import DEFAULT_OPSET, export_onnx
+from models.registry import registry
+
+EXPORTABLE = [name for name, spec in registry.specs.items() if spec.onnx_export]
+
+
+def export_model(name: str, output_dir: str, opset: int, int8: bool) -> dict:
+    """Export the configured model (or its fallback) for `name`, loading it with PyTorch"""
+    spec = registry.spec(name)
+    errors = []
+    for model_id in [spec.model_id] + spec.fallback_ids:
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model_id)
+            model = spec.model_class.from_pretrained(model_id)
+        except Exception as e:
+            print(f"Error loading model {model_id}: {str(e)}")
+            errors.append(str(e))
+            continue
+        return export_onnx(model, tokenizer, output_dir, model_id, opset=opset, int8=int8)
+    raise RuntimeError(f"Could not load {name}: {'; '.join(errors)}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export encoder models to ONNX")
+    parser.add_argument("--models", nargs="+", choices=EXPORTABLE, default=EXPORTABLE)
+    parser.add_argument("--output-dir", default=os.getenv("ONNX_DIR", "onnx_models"))
+    parser.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+    parser.add_argument("--int8", action="store_true", help="Also write a dynamically quantized int8 graph")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for name in args.models:
+        report[name] = export_model(name, os.path.join(args.output_dir, name), args.opset, args.int8)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Model Snapshots
+Saves every configured model (weights as safetensors, config and tokenizer) into a local store,
+so servers can start from MODEL_STORE without contacting the Hugging Face hub.
+
+Usage (from the server directory):
+    python -m scripts.snapshot_models --store /srv/model-store
+    python -m scripts.snapshot_models --store /srv/model-store --models metaphor_classifier masking_predict
+    python -m scripts.snapshot_models --store /srv/model-store --verify
+    MODEL_STORE=/srv/model-store HF_HUB_OFFLINE=1 python main.py
+
+Each model is written to <store>/<model name> with a snapshot.json recording the source model,
+the hub commit it was resolved to and a sha256 of every file.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List
+
+import torch
+from transformers import AutoTokenizer
+
+from models.registry import SNAPSHOT_FILE, has_meta_tensors, registry
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_model(name: str, store: str) -> Dict:
+    """Download (or reuse the hub cache for) one model and write its snapshot"""
+    spec = registry.spec(name)
+    errors = []
+    for model_id in [spec.model_id] + spec.fallback_ids:
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model_id, revision=spec.revision)
+            model = spec.model_class.from_pretrained(model_id, revision=spec.revision)
+        except Exception as e:
+            print(f"Error loading model {model_id}: {str(e)}")
+            errors.append(str(e))
+            continue
+
+        # Write next to the final location and swap it in, so a server never sees a half-written snapshot
+        target = os.path.join(store, name)
+        staging = f"{target}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        model.save_pretrained(staging, safe_serialization=True)
+        tokenizer.save_pretrained(staging)
+
+        snapshot = {
+            "source_model": model_id,
+            "revision": getattr(model.config, "_commit_hash", None) or spec.revision,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "files": {file: _sha256(os.path.join(staging, file)) for file in sorted(os.listdir(staging))},
+        }
+        with open(os.path.join(staging, SNAPSHOT_FILE), "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2)
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        return {"path": target, **snapshot}
+
+    raise RuntimeError(f"Could not load {name}: {'; '.join(errors)}")
+
+
+def verify_snapshot(name: str, store: str) -> List[str]:
+    """Files of a snapshot that are missing or no longer match their recorded sha256"""
+    path = os.path.join(store, name)
+    with open(os.path.join(path, SNAPSHOT_FILE), encoding="utf-8") as f:
+        files = json.load(f)["files"]
+    return [file for file, digest in files.items()
+            if not os.path.exists(os.path.join(path, file)) or _sha256(os.path.join(path, file)) != digest]
+
+
+def check_concurrent_load(names: List[str], store: str) -> Dict[str, str]:
+    """
+    Load the snapshots of `names` at the same time, as server startup does,
+    and return an error for each one that did not load completely from the store.
+    """
+    for name in names:
+        spec = registry.spec(name)
+        spec.store_path = os.path.join(store, name)
+        # The snapshot holds the PyTorch weights, whatever backend serves the model
+        spec.backend = "torch"
+    registry.preload(names, max_workers=len(names))
+
+    errors = {}
+    for name in names:
+        entry = registry.loaded(name)
+        if entry is None:
+            errors[name] = "not loaded"
+        elif entry.loaded_from != registry.spec(name).store_path:
+            errors[name] = f"loaded from {entry.loaded_from} instead of the store"
+        elif isinstance(entry.model, torch.nn.Module) and has_meta_tensors(entry.model):
+            errors[name] = "weights left on the meta device"
+    return errors
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Snapshot the configured models into a local store")
+    parser.add_argument("--store", default=os.getenv("MODEL_STORE"), required=os.getenv("MODEL_STORE") is None,
+                        help="Store directory (default: MODEL_STORE)")
+    parser.add_argument("--models", nargs="+", choices=list(registry.specs), default=list(registry.specs))
+    parser.add_argument("--verify", action="store_true",
+                        help="Check existing snapshots against their checksums and load them concurrently instead")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.store, exist_ok=True)
+    if args.verify:
+        report = {name: verify_snapshot(name, args.store) for name in args.models}
+        load_errors = check_concurrent_load(args.models, args.store)
+        print(json.dumps({name: {"mismatched_files": files, "load_error": load_errors.get(name)}
+                          for name, files in report.items()}, indent=2))
+        return 1 if any(report.values()) or load_errors else 0
+
+    report = {name: snapshot_model(name, args.store) for name in args.models}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Streaming
+This module bridges token callbacks from generation threads to Server-Sent Events responses.
+"""
+import asyncio
+import json
+import threading
+from typing import Any, AsyncIterator, Callable, Dict
+
+from fastapi import Request
+
+
+class TokenChannel:
+    """
+    Carries decoded text from a generation thread to the event loop.
+
+    Pass `on_text` and `should_stop` to the model's streaming function; call
+    `cancel()` to make the next generation step stop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.cancelled = threading.Event()
+        self.index = 0
+
+    def on_text(self, text: str, stream_end: bool = False):
+        # Called from the worker thread
+        index = self.index
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, {"index": index, "text": text})
+        if stream_end:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, {"index": index, "end": True})
+            self.index += 1
+
+    def should_stop(self) -> bool:
+        return self.cancelled.is_set()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _token_event(item: Dict[str, Any]) -> str:
+    if item.get("end"):
+        return sse_event("end", {"index": item["index"]})
+    return sse_event("token", item)
+
+
+async def stream_events(request: Request, channel: TokenChannel, job: asyncio.Future,
+                        build_result: Callable[[Any], Dict[str, Any]], poll_seconds: float = 0.25) -> AsyncIterator[str]:
+    """
+    Yield SSE `token` events while `job` runs, then a final `done` (or `error`) event.
+
+    If the client disconnects the channel is cancelled so generation stops at
+    the next token instead of running to completion.
+    """
+    get = None
+    try:
+        while True:
+            if await request.is_disconnected():
+                channel.cancel()
+                return
+
+            # Wake up for the next token or the end of the job, whichever comes first,
+            # so `done` goes out as soon as generation finishes
+            if get is None:
+                get = asyncio.ensure_future(channel.queue.get())
+            await asyncio.wait({get, job}, timeout=poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+            if get.done():
+                item, get = get.result(), None
+                yield _token_event(item)
+            elif job.done():
+                break
+
+        # Text is queued before the job completes; a cancelled get leaves its item in the queue
+        get.cancel()
+        get = None
+        while not channel.queue.empty():
+            yield _token_event(channel.queue.get_nowait())
+
+        try:
+            result = job.result()
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        yield sse_event("done", build_result(result))
+    finally:
+        if get is not None:
+            get.cancel()
+        # Covers the response being torn down mid-stream as well
+        if not job.done():
+            channel.cancel()
@@ -0,0 +1,101 @@
+"""
+Model Warm-up
+This module loads every model up front, in parallel, and tracks per-model load state for the health endpoints.
+"""
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from models import lyric_generator, masking_predict, metaphor_classifier, metaphor_creator
+from models.registry import registry
+
+MODEL_MODULES = {
+    "metaphor_creator": metaphor_creator,
+    "metaphor_classifier": metaphor_classifier,
+    "lyric_generator": lyric_generator,
+    "masking_predict": masking_predict,
+}
+
+
+class ModelState:
+    """Load progress of a single model"""
+
+    def __init__(self):
+        # pending -> loading -> warming -> ready, or failed / fallback;
+        # on_demand when preloading is disabled and the model loads on first use
+        self.state = "pending"
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        # Identity of the loaded model (see ModelEntry.identity), None until one has loaded
+        self.model: Optional[Dict] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+            "model": self.model,
+        }
+
+
+model_states: Dict[str, ModelState] = {name: ModelState() for name in MODEL_MODULES}
+
+
+def load_and_warm(name: str):
+    """Load one model and run its dummy inference, recording timings"""
+    module = MODEL_MODULES[name]
+    status = model_states[name]
+    try:
+        status.state = "loading"
+        start = time.perf_counter()
+        module.load_model()
+        status.load_seconds = round(time.perf_counter() - start, 3)
+        status.model = registry.identity(module.REGISTRY_NAME)
+
+        if module.model is None:
+            # The module serves predefined fallbacks when its model cannot load
+            status.state = "fallback"
+            return
+
+        status.state = "warming"
+        start = time.perf_counter()
+        module.warmup()
+        status.warmup_seconds = round(time.perf_counter() - start, 3)
+        status.state = "ready"
+    except Exception as e:
+        traceback.print_exc()
+        status.state = "failed"
+        status.error = str(e)
+
+
+def warm_up_all(max_workers: int = len(MODEL_MODULES)):
+    """Load and warm all models concurrently; blocks until every model is done"""
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="warmup") as pool:
+        list(pool.map(load_and_warm, MODEL_MODULES))
+
+
+def mark_on_demand():
+    """Record that models are not preloaded (PRELOAD_MODELS=0) but load on their first request"""
+    for status in model_states.values():
+        if status.state == "pending":
+            status.state = "on_demand"
+
+
+def is_ready() -> bool:
+    """True once every model has finished loading (fallback mode counts as serving), or loads on demand"""
+    return all(status.state in ("ready", "fallback", "on_demand") for status in model_states.values())
+
+
+def status_report() -> Dict[str, Dict]:
+    report = {}
+    for name, status in model_states.items():
+        report[name] = status.to_dict()
+        if status.state == "on_demand":
+            # Loaded by a request rather than by warm-up; the registry knows whether that happened yet
+            model = registry.identity(MODEL_MODULES[name].REGISTRY_NAME)
+            if model is not None:
+                report[name].update(state="loaded", model=model)
+    return report
@@ -0,0 +1,441 @@
+"""
+Model Worker Processes
+This module runs each model in its own pool of worker processes, pinned to CPU cores and fed
+from a shared request queue over pipes, behind the same interface as the thread pools in inference.py.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from inference import ModelPool, QueueFullError
+
+# How often the result reader checks for cancelled streams and dead workers
+POLL_SECONDS = 0.1
+# Delay before restarting a worker that died before it finished loading, doubled on every
+# further failure up to the maximum
+RESTART_BACKOFF_SECONDS = 1.0
+RESTART_BACKOFF_MAX_SECONDS = 60.0
+
+
+def parse_cpus(value: Optional[str]) -> List[int]:
+    """CPU list such as "0-3,6" as a list of core ids"""
+    cores = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-")
+            cores.extend(range(int(first), int(last) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _split(cores: List[int], workers: int) -> List[Tuple[List[int], int]]:
+    """(cores, threads) for each of `workers` workers; with fewer cores than workers they share all of them"""
+    if len(cores) < workers:
+        return [(list(cores), max(1, len(cores) // workers))] * workers
+    size, extra = divmod(len(cores), workers)
+    slices, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append((cores[start:end], end - start))
+        start = end
+    return slices
+
+
+def assign_cpus(workers: Dict[str, int], pinned: Dict[str, List[int]], available: List[int]) -> Dict[str, List[Tuple[List[int], int]]]:
+    """
+    Decide which cores each worker process runs on and how many threads it uses.
+
+    Models with an explicit core list split it among their own workers. All
+    other workers split the remaining cores evenly (or all cores, if the
+    explicit lists took every one).
+
+    Returns:
+        Dict mapping model name to one (cores, threads) pair per worker
+    """
+    plan = {name: _split(pinned[name], count) for name, count in workers.items() if pinned.get(name)}
+    remaining = [core for core in available if not any(core in cores for cores in pinned.values())] or available
+    unpinned = [name for name in workers if name not in plan]
+    slices = iter(_split(remaining, sum(workers[name] for name in unpinned) or 1))
+    for name in unpinned:
+        plan[name] = [next(slices) for _ in range(workers[name])]
+    return plan
+
+
+def worker_main(model_name: str, cores: List[int], threads: int, conn: Connection):
+    """
+    Entry point of a model worker process: pin to `cores`, load and warm the
+    model, then run the calls sent over `conn` one at a time until told to stop.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # Set before the model libraries size their thread pools; also read by ONNX Runtime sessions
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ[f"{model_name.upper()}_THREADS"] = str(threads)
+
+    import torch
+    torch.set_num_threads(threads)
+
+    import metrics
+    import warmup
+
+    warmup.load_and_warm(model_name)
+    conn.send(("state", warmup.model_states[model_name].to_dict()))
+
+    stopping = False
+    while not stopping:
+        message = conn.recv()
+        if message[0] == "stop":
+            break
+        if message[0] != "call":
+            # A cancellation that arrived after its call finished
+            continue
+        _, job_id, payload = message
+        cancelled = False
+
+        def should_stop() -> bool:
+            # Only cancellations (or a shutdown) can arrive while a call runs
+            nonlocal cancelled, stopping
+            while not cancelled and conn.poll():
+                kind = conn.recv()[0]
+                stopping = stopping or kind == "stop"
+                cancelled = True
+            return cancelled
+
+        start = time.perf_counter()
+        kwargs = {}
+        with metrics.recording() as recorded:
+            try:
+                fn, args, kwargs, streaming = pickle.loads(payload)
+                if streaming:
+                    kwargs["on_text"] = lambda text, stream_end=False: conn.send(("text", job_id, text, stream_end))
+                    kwargs["should_stop"] = should_stop
+                outcome = (True, fn(*args, **kwargs))
+            except Exception as e:
+                traceback.print_exc()
+                outcome = (False, e)
+        try:
+            result = pickle.dumps(outcome)
+        except Exception as e:
+            result = pickle.dumps((False, RuntimeError(f"Could not send the result of {model_name}: {str(e)}")))
+        deadline_hit = getattr(kwargs.get("deadline"), "hit", False)
+        conn.send(("done", job_id, result, time.perf_counter() - start, recorded, deadline_hit))
+
+
+class _Job:
+    def __init__(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future, payload: bytes, on_text: Optional[Callable],
+                 should_stop: Optional[Callable[[], bool]], deadline: Any, timings: Optional[list]):
+        self.loop = loop
+        self.future = future
+        self.payload = payload
+        self.on_text = on_text
+        self.should_stop = should_stop
+        self.deadline = deadline
+        self.timings = timings
+        self.cancel_sent = False
+
+
+class _Worker:
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        # Set once the model is loaded; None while idle
+        self.ready = False
+        self.job_id: Optional[int] = None
+
+
+class ProcessModelPool(ModelPool):
+    """
+    Worker processes for one model. Calls wait in one shared queue here and
+    are handed to whichever worker is idle, over a pipe per worker.
+
+    Calls and their results cross the process boundary pickled, so `fn` must
+    be a module-level function (or a functools.partial of one). Streaming
+    calls work as with threads: `on_text` is relayed back from the worker and
+    `should_stop` is polled here and forwarded as a cancellation. A `deadline`
+    keyword argument gets its `hit` flag copied back. A worker that dies fails
+    the call it was running and is replaced. A worker that keeps dying before
+    its model is loaded is restarted with exponential backoff and given up on
+    after `max_restarts` attempts, which marks the model as failed.
+    """
+
+    def __init__(self, name: str, workers: int = 1, max_queue: int = 16, cpus: Optional[List[Tuple[List[int], int]]] = None,
+                 max_restarts: int = 5):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.cpus = cpus or [([], 1)] * self.workers
+        self.max_restarts = max(0, max_restarts)
+        self.pending = 0
+        self.avg_seconds = 1.0
+
+        # spawn: forking a process that already runs torch threads is not safe
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: List[Optional[_Worker]] = [None] * self.workers
+        self.worker_states: Dict[int, Dict] = {}
+        self.jobs: Dict[int, _Job] = {}
+        self.backlog: Deque[int] = deque()
+        # Per worker slot: deaths in a row before the model loaded, and when a restart is due
+        self.failed_starts: Dict[int, int] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.given_up: Set[int] = set()
+        self._ids = itertools.count()
+        # Guards jobs, backlog and worker state, which the event loop and the result reader both touch
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._reader = threading.Thread(target=self._read_results, name=f"results-{self.name}", daemon=True)
+        self._reader.start()
+
+    def _spawn(self, index: int):
+        cores, threads = self.cpus[index]
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=worker_main,
+            args=(self.name, cores, threads, child_conn),
+            name=f"worker-{self.name}-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker keeps its end open, so its exit shows up as EOF here
+        child_conn.close()
+        self.processes[index] = _Worker(process, conn)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """Queue a call and return a future for it; raises QueueFullError right away when full"""
+        if len(self.given_up) == self.workers:
+            raise RuntimeError(f"{self.name} workers could not be started")
+        if self.pending >= self.workers + self.max_queue:
+            raise QueueFullError(self.name, self.retry_after())
+
+        import metrics
+
+        on_text = kwargs.pop("on_text", None)
+        should_stop = kwargs.pop("should_stop", None)
+        # Pickle here so a call that cannot be sent fails in the request that made it
+        payload = pickle.dumps((fn, args, kwargs, on_text is not None))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job_id = next(self._ids)
+        self.pending += 1
+        future.add_done_callback(self._release)
+        with self._lock:
+            self.jobs[job_id] = _Job(loop, future, payload, on_text, should_stop, kwargs.get("deadline"), metrics.request_timings())
+            self.backlog.append(job_id)
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Hand waiting calls to idle workers (with self._lock held)"""
+        for worker in self.processes:
+            if not self.backlog:
+                return
+            if worker is None or not worker.ready or worker.job_id is not None:
+                continue
+            job_id = self.backlog.popleft()
+            job = self.jobs.get(job_id)
+            if job is None or job.future.done():
+                # Cancelled while waiting (e.g. the client went away)
+                self.jobs.pop(job_id, None)
+                continue
+            worker.job_id = job_id
+            worker.conn.send(("call", job_id, job.payload))
+
+    def _read_results(self):
+        import metrics
+
+        while not self._stopping.is_set():
+            self._restart_due_workers()
+            workers = {worker.conn: index for index, worker in enumerate(self.processes) if worker is not None}
+            for conn in wait(list(workers), timeout=POLL_SECONDS):
+                index = workers[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    self._replace_worker(index)
+                    continue
+
+                kind = message[0]
+                if kind == "state":
+                    self.failed_starts.pop(index, None)
+                    self._update_state(index, message[1])
+                    with self._lock:
+                        self.processes[index].ready = True
+                        self._dispatch()
+                elif kind == "text":
+                    job = self.jobs.get(message[1])
+                    if job is not None and job.on_text is not None:
+                        job.on_text(message[2], message[3])
+                elif kind == "done":
+                    _, job_id, result, seconds, recorded, deadline_hit = message
+                    self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+                    with self._lock:
+                        job = self.jobs.pop(job_id, None)
+                        self.processes[index].job_id = None
+                        self._dispatch()
+                    if job is not None:
+                        metrics.replay(recorded, job.timings)
+                        if deadline_hit:
+                            job.deadline.hit = True
+                        ok, value = pickle.loads(result)
+                        job.loop.call_soon_threadsafe(self._resolve, job.future, ok, value)
+
+            self._forward_cancellations()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, value: Any):
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _forward_cancellations(self):
+        with self._lock:
+            for worker in self.processes:
+                job = self.jobs.get(worker.job_id) if worker is not None and worker.job_id is not None else None
+                if job is not None and job.should_stop is not None and not job.cancel_sent and job.should_stop():
+                    job.cancel_sent = True
+                    worker.conn.send(("cancel", worker.job_id))
+
+    def _replace_worker(self, index: int):
+        if self._stopping.is_set():
+            return
+        worker = self.processes[index]
+        worker.process.join(timeout=1)
+        worker.conn.close()
+        exitcode = worker.process.exitcode
+        # A worker that served requests before dying is restarted at once
+        failures = 0 if worker.ready else self.failed_starts.get(index, 0) + 1
+        self.failed_starts[index] = failures
+        with self._lock:
+            job = self.jobs.pop(worker.job_id, None) if worker.job_id is not None else None
+            self.processes[index] = None
+            if failures > self.max_restarts:
+                self.given_up.add(index)
+            else:
+                delay = min(RESTART_BACKOFF_MAX_SECONDS, RESTART_BACKOFF_SECONDS * 2 ** (failures - 1)) if failures else 0.0
+                self.restart_at[index] = time.monotonic() + delay
+        if job is not None:
+            error = RuntimeError(f"{self.name} worker exited with code {exitcode}")
+            job.loop.call_soon_threadsafe(self._resolve, job.future, False, error)
+
+        if index in self.given_up:
+            print(f"Worker {worker.process.name} exited with code {exitcode} before loading its model "
+                  f"{failures} times in a row, not restarting it")
+            self._give_up(index, f"worker exited with code {exitcode} while loading, {failures} times in a row")
+        else:
+            print(f"Worker {worker.process.name} exited with code {exitcode}, restarting it"
+                  + (f" in {self.restart_at[index] - time.monotonic():.1f}s" if failures else ""))
+
+    def _restart_due_workers(self):
+        now = time.monotonic()
+        for index, due in list(self.restart_at.items()):
+            if due <= now:
+                del self.restart_at[index]
+                with self._lock:
+                    self._spawn(index)
+
+    def _give_up(self, index: int, error: str):
+        """Record a worker slot that will not be restarted; with none left, mark the model failed and fail its calls"""
+        import warmup
+
+        self._update_state(index, {"state": "failed", "load_seconds": None, "warmup_seconds": None, "error": error, "model": None})
+        if len(self.given_up) < self.workers:
+            # The other workers keep serving
+            return
+        status = warmup.model_states[self.name]
+        status.state = "failed"
+        status.error = error
+        status.model = None
+        with self._lock:
+            jobs, self.jobs = list(self.jobs.values()), {}
+            self.backlog.clear()
+        for job in jobs:
+            job.loop.call_soon_threadsafe(self._resolve, job.future, False, RuntimeError(f"{self.name} workers could not be started: {error}"))
+
+    def _update_state(self, index: int, state: Dict):
+        """Report the model as loaded once every worker has loaded it, or as failed if any failed"""
+        import warmup
+
+        self.worker_states[index] = state
+        if len(self.worker_states) < self.workers:
+            return
+        states = list(self.worker_states.values())
+        status = warmup.model_states[self.name]
+        for candidate in ("failed", "fallback", "ready"):
+            if any(s["state"] == candidate for s in states):
+                status.state = candidate
+                break
+        status.load_seconds = max((s["load_seconds"] or 0) for s in states)
+        status.warmup_seconds = max((s["warmup_seconds"] or 0) for s in states)
+        status.error = next((s["error"] for s in states if s["error"]), None)
+        # Results are only attributable to one model while every worker serves the same one
+        status.model = states[0]["model"] if all(s["model"] == states[0]["model"] for s in states) else None
+
+    def shutdown(self):
+        self._stopping.set()
+        with self._lock:
+            for worker in self.processes:
+                if worker is not None:
+                    try:
+                        worker.conn.send(("stop",))
+                    except OSError:
+                        pass
+            jobs, self.jobs = list(self.jobs.values()), {}
+            self.backlog.clear()
+        deadline = time.monotonic() + 5
+        for worker in self.processes:
+            if worker is not None:
+                worker.process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        for job in jobs:
+            job.loop.call_soon_threadsafe(job.future.cancel)
+
+
+def process_pools(names: List[str]) -> Dict[str, ProcessModelPool]:
+    """
+    Worker process pools for `names`, sized from `<MODEL>_WORKERS` and
+    `<MODEL>_QUEUE_SIZE`, pinned to `<MODEL>_CPUS` (e.g. "0-3") or to an even
+    share of the unclaimed cores, with `<MODEL>_THREADS` overriding the
+    thread count per worker. WORKER_MAX_RESTARTS bounds how often a worker that
+    dies while loading is restarted.
+    """
+    workers = {name: max(1, int(os.getenv(f"{name.upper()}_WORKERS", "1"))) for name in names}
+    pinned = {name: parse_cpus(os.getenv(f"{name.upper()}_CPUS")) for name in names}
+    plan = assign_cpus(workers, pinned, available_cpus())
+
+    pools = {}
+    for name in names:
+        threads = os.getenv(f"{name.upper()}_THREADS")
+        cpus = [(cores, int(threads) if threads else count) for cores, count in plan[name]]
+        pools[name] = ProcessModelPool(
+            name,
+            workers=workers[name],
+            max_queue=int(os.getenv(f"{name.upper()}_QUEUE_SIZE", "16")),
+            cpus=cpus,
+            max_restarts=int(os.getenv("WORKER_MAX_RESTARTS", "5")),
+        )
+    return pools